@@ -1,5 +1,4 @@
 #!/usr/bin/env python3
-import sys
 # ultra-fast JSON parsing if available
 try:
     import ujson as json
@@ -10,12 +9,15 @@ from mrjob.job import MRJob
 from mrjob.step import MRStep
 from mrjob.protocol import RawValueProtocol
 
+import src_path
+from tokenizer import REGEX_DELIMITERS, Tokenizer
+
 class ChiSquareCalculator(MRJob):
     OUTPUT_PROTOCOL = RawValueProtocol
+    FILES = ['src_path.py', '../src/tokenizer.py#tokenizer.py']
 
-    # characters to translate to spaces (delimiters + digits)
-    _DELIMS = '()[]{}.!?,;:+=-_"\'"`~#@&*%€$§\\/0123456789'
-    TRANSLATOR = str.maketrans({c: ' ' for c in _DELIMS})
+    # delimiters + '$' + digits translated to spaces
+    TOKENIZER = Tokenizer(REGEX_DELIMITERS)
 
     def configure_args(self):
         super(ChiSquareCalculator, self).configure_args()
@@ -29,7 +31,7 @@ class ChiSquareCalculator(MRJob):
                 for line in f:
                     sw.add(line.strip())
         self.stopwords = sw
-        self.translator = ChiSquareCalculator.TRANSLATOR
+        self.tokenize = ChiSquareCalculator.TOKENIZER.tokenize
 
         # in-mapper combiner buffers
         self.buf = {}
@@ -45,8 +47,7 @@ class ChiSquareCalculator(MRJob):
         self.ev_count += 1
         self.buf[('!DOC_COUNT', cat)] = self.buf.get(('!DOC_COUNT', cat), 0) + 1
 
-        text = (doc.get('reviewText','') + ' ' + doc.get('summary','')).lower()
-        toks = text.translate(self.translator).split()
+        toks = self.tokenize(doc.get('reviewText','') + ' ' + doc.get('summary',''))
 
         seen = set()
         sw = self.stopwords
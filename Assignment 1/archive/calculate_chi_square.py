@@ -4,15 +4,21 @@ from collections import defaultdict
 import csv
 import io
 import ast
-import sys
+
+import src_path
+from stopword_filter import read_stopwords
+from token_cache import document_frequencies, read_vocabulary
 
 class ChiSquareUnigrams(MRJob):
+    FILES = ['src_path.py', '../src/stopword_filter.py#stopword_filter.py', '../src/token_cache.py#token_cache.py']
 
     def configure_args(self):
         super(ChiSquareUnigrams, self).configure_args()
         self.add_passthru_arg('--category-col', default='category', help='Column name containing categories')
         self.add_passthru_arg('--tokens-col', default='reviewText_tokens', help='Column name containing tokens')
         self.add_passthru_arg('--csv-header', help='CSV header line to use for all mappers')
+        self.add_file_arg('--token-vocab', help='Vocabulary of a Parquet token cache given as input')
+        self.add_file_arg('--stopwords', help='Stopwords removed from the tokens')
 
     def mapper_init(self):
         try:
@@ -21,6 +27,7 @@ class ChiSquareUnigrams(MRJob):
         except Exception as e:
             self.stderr.write(f"ERROR: Failed to parse CSV header: {e}\n".encode('utf-8'))
             self.header = []
+        self.stopwords = set(read_stopwords(self.options.stopwords)) if self.options.stopwords else set()
 
     def mapper_extract_terms(self, _, line_input):
         line_str = line_input.decode('utf-8') if isinstance(line_input, bytes) else line_input
@@ -44,7 +51,7 @@ class ChiSquareUnigrams(MRJob):
             for raw in tokens:
                 if isinstance(raw, str):
                     tok = raw.strip().lower()
-                    if tok and tok not in seen:
+                    if tok and tok not in seen and tok not in self.stopwords:
                         seen.add(tok)
                         yield (category, tok), 1
                         yield ('*', tok), 1
@@ -52,6 +59,18 @@ class ChiSquareUnigrams(MRJob):
             preview = line_str[:100] + ('...' if len(line_str) > 100 else '')
             self.stderr.write(f"ERROR processing line: {e} - Line: {preview}\n".encode('utf-8'))
 
+    def mapper_token_cache(self, input_path, input_uri):
+        # counts of a whole token cache file, streamed one row group at a time
+        stopwords = set(read_stopwords(self.options.stopwords)) if self.options.stopwords else ()
+        vocabulary = read_vocabulary(self.options.token_vocab)
+        doc_counts, pairs, totals = document_frequencies(input_path, vocabulary, stopwords)
+        for category, count in doc_counts.items():
+            yield ('!DOC_COUNT', category), count
+        for (category, term), count in pairs.items():
+            yield (category, term), count
+        for term, count in totals.items():
+            yield ('*', term), count
+
     def combiner(self, key, counts):
         yield key, sum(counts)
 
@@ -113,18 +132,27 @@ class ChiSquareUnigrams(MRJob):
                 'expected': expected,
                 'chi_square': chi,
                 'total_term': term_total,
-                'total_category': C
+                'total_category': C,
+                'total_docs': N
             }
 
         
     def steps(self):
-        return [
-            MRStep(
+        if self.options.token_vocab:
+            first = MRStep(
+                mapper_raw=self.mapper_token_cache,
+                combiner=self.combiner,
+                reducer=self.reducer_sum_counts
+            )
+        else:
+            first = MRStep(
                 mapper_init=self.mapper_init,
                 mapper=self.mapper_extract_terms,
                 combiner=self.combiner,
                 reducer=self.reducer_sum_counts
-            ),
+            )
+        return [
+            first,
             MRStep(
                 mapper=self.mapper_organize_for_chi,
                 reducer=self.reducer_group_all_data
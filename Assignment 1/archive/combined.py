@@ -1,6 +1,4 @@
-import sys
 import json
-import re
 import ast
 from mrjob.job import MRJob
 from mrjob.step import MRStep
@@ -8,10 +6,15 @@ import logging
 
 from mrjob.protocol import RawValueProtocol
 
+import src_path
+from tokenizer import REGEX_TOKENIZER
 
 
 class ChiSquareCalculator(MRJob):
     OUTPUT_PROTOCOL = RawValueProtocol
+    FILES = ['src_path.py', '../src/tokenizer.py#tokenizer.py']
+    TOKENIZER = REGEX_TOKENIZER
+
     def configure_args(self):
         super().configure_args()
         self.add_file_arg('--stopwords')
@@ -23,10 +26,8 @@ class ChiSquareCalculator(MRJob):
                 self.stopwords = set(line.strip() for line in f)
 
     def tokenize_and_filter(self, text, stopwords):
-        delimiter_chars = r'()\[\]{}.!?,;:+=\-_"\'`~#@&*%€$§\\/'
-        split_pattern = rf'[\s\d{re.escape(delimiter_chars)}]+'
-        tokens = re.split(split_pattern, str(text).lower())
-        filtered_tokens = [t for t in tokens if t and t not in stopwords and len(t) > 1]
+        tokens = self.TOKENIZER.tokenize(str(text))
+        filtered_tokens = [t for t in tokens if t not in stopwords and len(t) > 1]
         return filtered_tokens
 
     def mapper_extract_terms(self, _, line):
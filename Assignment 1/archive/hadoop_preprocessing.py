@@ -1,13 +1,17 @@
+import os
 import sys
 import json
-import re
 from mrjob.job import MRJob
 from mrjob.step import MRStep
 from mrjob.protocol import RawValueProtocol
 
+import src_path
+from tokenizer import REGEX_TOKENIZER
+
 
 class HadoopPreprocessor(MRJob):
     OUTPUT_PROTOCOL = RawValueProtocol
+    FILES = ['src_path.py', '../src/tokenizer.py#tokenizer.py']
 
     def configure_args(self):
         super().configure_args()
@@ -33,6 +37,38 @@ class HadoopPreprocessor(MRJob):
         except Exception as e:
             sys.stderr.write(f"ERROR: {str(e)}\n")
 
+    def run_job(self):
+        # local runs read the input files through the memory-mapped reader instead of mrjob's runner
+        paths = self.options.args
+        local = (self.options.runner or 'inline') in ('inline', 'local')
+        if local and paths and all(os.path.isfile(p) for p in paths):
+            self.run_local(paths)
+        else:
+            super().run_job()
+
+    def run_local(self, paths):
+        from review_reader import read_range
+
+        self.mapper_init()
+        values = []
+        for path in paths:
+            for line in read_range(path):
+                for _, value in self.mapper(None, line):
+                    values.append(value)
+
+        out = self.stdout
+        if self.options.output_dir:
+            os.makedirs(self.options.output_dir, exist_ok=True)
+            out = open(os.path.join(self.options.output_dir, 'part-00000'), 'wb')
+        write = self.output_protocol().write
+        try:
+            for key, value in self.reducer(None, values):
+                out.write(write(key, value) + b'\n')
+        finally:
+            if out is not self.stdout:
+                out.close()
+        self.stdout.flush()
+
     def reducer(self, key, values):
         yield None, "reviewText_tokens,category"
 
@@ -41,10 +77,8 @@ class HadoopPreprocessor(MRJob):
             yield None, f'"{tokens_str}",{value["category"]}'
 
     def tokenize_and_filter(self, text, stopwords):
-        delimiter_chars = r'()\[\]{}.!?,;:+=\-_"\'`~#@&*%€$§\\/'
-        split_pattern = rf'[\s\d{re.escape(delimiter_chars)}]+'
-        tokens = re.split(split_pattern, str(text).lower())
-        return [t for t in tokens if t and t not in stopwords and len(t) > 1]
+        tokens = REGEX_TOKENIZER.tokenize(str(text))
+        return [t for t in tokens if t not in stopwords and len(t) > 1]
 
 
 if __name__ == '__main__':
@@ -4,9 +4,13 @@ import csv
 import io
 import ast
 import sys
+import numpy as np
 import pandas as pd
 import logging
 
+import src_path
+from chi_kernel import chi_square
+
 
 class ChiSquareUnigrams(MRJob):
     # Configure logging to write to a file
@@ -230,41 +234,40 @@ class ChiSquareUnigrams(MRJob):
         # total docs across all categories
         N = sum(self.category_doc_counts.values())
 
-        results = []
+        # flatten the buffered pairs into columns for the vectorized kernel
+        tokens, categories, A, token_total, C_total = [], [], [], [], []
         for token, cat_list in self.pairs_buffer.items():
-            token_total = self.token_doc_counts.get(token, 0)
-            for (category, A) in cat_list:
-                C_total = self.category_doc_counts.get(category, 0)
-                C_formula = C_total - A  # Docs in category WITHOUT the token
-                B = token_total - A
-                D = N - C_total - B  # Docs without token in other categories (correct)
-
-                # Compute denominator terms
-                denom_product = (A + B) * (A + C_formula) * (B + D) * (C_formula + D)
-                chi = (N * (A * D - B * C_formula) ** 2) / denom_product if denom_product != 0 else 0
-                logging.debug(f"A={A}, B={B}, C_total={C_total}, C_formula={C_formula}, D={D}")
-
-                expected_val = (token_total * C_formula / float(N)) if N else 0
-
-                # Collect the result
-                results.append({
-                    "token": token,
-                    "category": category,
-                    "observed": A,
-                    "expected": expected_val,
-                    "chi_square": chi,
-                    "total_term": token_total,     # how many docs contain this token overall
-                    "total_category": C_total            # how many docs in this category overall
-                })
-
-        # Once done, yield them all
-        for item in results:
-            yield (item["token"], item["category"]), {
-                "observed": item["observed"],
-                "expected": item["expected"],
-                "chi_square": item["chi_square"],
-                "total_term": item["total_term"],
-                "total_category": item["total_category"]
+            total = self.token_doc_counts.get(token, 0)
+            for (category, a_val) in cat_list:
+                tokens.append(token)
+                categories.append(category)
+                A.append(a_val)
+                token_total.append(total)
+                C_total.append(self.category_doc_counts.get(category, 0))
+        if not tokens:
+            return
+
+        A = np.array(A, dtype=np.int64)
+        token_total = np.array(token_total, dtype=np.int64)
+        C_total = np.array(C_total, dtype=np.int64)
+        C_formula = C_total - A  # Docs in category WITHOUT the token
+        B = token_total - A
+        D = N - C_total - B  # Docs without token in other categories (correct)
+
+        # zero denominators keep their old score of 0
+        chi = np.nan_to_num(chi_square(A, B, C_formula, D), nan=0.0)
+        expected = token_total * C_formula / float(N) if N else np.zeros(len(tokens))
+        logging.debug(f"computed chi-square for {len(tokens)} (token, category) pairs, N={N}")
+
+        for token, category, observed, expected_val, chi_val, total, cat_total in zip(
+                tokens, categories, A.tolist(), expected.tolist(), chi.tolist(),
+                token_total.tolist(), C_total.tolist()):
+            yield (token, category), {
+                "observed": observed,
+                "expected": expected_val,
+                "chi_square": chi_val,
+                "total_term": total,     # how many docs contain this token overall
+                "total_category": cat_total            # how many docs in this category overall
             }
 
     def steps(self):
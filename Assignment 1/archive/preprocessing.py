@@ -1,7 +1,19 @@
 import pandas as pd
-import re
 import argparse
+import json
+import os
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import src_path
+from count_cache import file_fingerprint
+from review_reader import mapped, iter_lines
+from token_cache import TokenCacheWriter, read_metadata, vocabulary_path
+from tokenizer import REGEX_TOKENIZER as TOKENIZER
+
+# reviews per DataFrame chunk, bounds memory independently of the input size
+CHUNK_SIZE = 10000
 
 # --- Load stopwords ---
 def load_stopwords(filepath):
@@ -16,52 +28,152 @@ def load_stopwords(filepath):
 def tokenize_and_filter(text, stopwords):
     if pd.isna(text):
         return []
+    return [
+        token for token in TOKENIZER.tokenize(str(text))
+        if token not in stopwords and len(token) > 1
+    ]
 
-    delimiter_chars = r'()\[\]{}.!?,;:+=\-_"\'`~#@&*%€$§\\/'
-    split_pattern = rf'[\s\d{re.escape(delimiter_chars)}]+'
-
-    tokens = re.split(split_pattern, str(text).lower())
+def tokenize_and_filter_batch(texts, stopwords):
+    texts = ['' if pd.isna(text) else str(text) for text in texts]
     return [
-        token for token in tokens
-        if token and token not in stopwords and len(token) > 1
+        [token for token in tokens if token not in stopwords and len(token) > 1]
+        for tokens in TOKENIZER.tokenize_batch(texts)
     ]
 
+# --- Stream reviews in chunks ---
+def read_chunks(filepath, chunk_size=CHUNK_SIZE):
+    # lists of raw review lines, decoded by the worker that processes the chunk
+    with mapped(filepath) as buf:
+        lines = []
+        for line in iter_lines(buf):
+            lines.append(line)
+            if len(lines) >= chunk_size:
+                yield lines
+                lines = []
+        if lines:
+            yield lines
+
+def chunk_frame(lines):
+    return pd.DataFrame([json.loads(line) for line in lines])
+
 # --- Main preprocessing ---
 def preprocess(df, stopwords, text_columns):
-    df_copy = df.copy()
+    # adds the token columns to df itself, every chunk frame is only used once
     for col in text_columns:
-        if col in df_copy.columns:
-            df_copy[col + '_tokens'] = df_copy[col].apply(lambda x: tokenize_and_filter(x, stopwords))
+        if col in df.columns:
+            df[col + '_tokens'] = pd.Series(tokenize_and_filter_batch(df[col], stopwords),
+                                            index=df.index, dtype=object)
         else:
             print(f"Warning: Column '{col}' not found in DataFrame.")
-    return df_copy
+    return df
+
+# --- Chunk workers ---
+# stopwords of the worker process, set once by the pool initializer
+_stopwords = set()
+
+def init_worker(stopwords):
+    global _stopwords
+    _stopwords = stopwords
+
+def csv_chunk(lines, header):
+    # one chunk as CSV text of the token columns
+    df_processed = preprocess(chunk_frame(lines), _stopwords, text_columns=['reviewText', 'summary'])
+    return df_processed.to_csv(index=False, header=header, columns=['reviewText_tokens', 'category'])
+
+def cache_chunk(lines):
+    # (category, tokens) rows of one chunk, stopwords stay in the cache
+    df = chunk_frame(lines)
+    categories = df['category'] if 'category' in df.columns else [''] * len(df)
+    texts = df['reviewText'] if 'reviewText' in df.columns else [''] * len(df)
+    return [('' if pd.isna(category) else str(category), tokens)
+            for category, tokens in zip(categories, tokenize_and_filter_batch(texts, ()))]
+
+def process_chunks(func, chunks, stopwords, workers):
+    # results of func over the argument tuples of chunks in input order, each as soon as it
+    # and all before it are done; at most 2 * workers chunks are read ahead of the output
+    if workers <= 1:
+        init_worker(stopwords)
+        for args in chunks:
+            yield func(*args)
+        return
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(stopwords,)) as pool:
+        pending = deque()
+        for args in chunks:
+            pending.append(pool.submit(func, *args))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+# --- Columnar token cache ---
+def token_cache_source(filepath):
+    # everything the token cache depends on, stopwords stay in the cache
+    return {'input': file_fingerprint(filepath), 'tokenizer': TOKENIZER.config()}
+
+def write_token_cache(filepath, output, workers=1, chunk_size=CHUNK_SIZE):
+    # stopwords stay in the cache, the chi-square jobs remove them while counting; rows are
+    # written in input order, so term IDs do not depend on the number of workers
+    with TokenCacheWriter(output, metadata=token_cache_source(filepath)) as cache:
+        chunks = ((lines,) for lines in read_chunks(filepath, chunk_size))
+        for rows in process_chunks(cache_chunk, chunks, (), workers):
+            for category, tokens in rows:
+                cache.write(category, tokens)
+
+# --- Output files ---
+def partial_path(path):
+    # file written in place of path and renamed over it once complete
+    root, ext = os.path.splitext(path)
+    return f"{root}.partial-{os.getpid()}{ext}"
+
+def remove_files(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
 
 # --- Script entry point ---
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--input', required=True, help='Path to the input CSV file')
-    parser.add_argument('--output', default='chi_input.csv', help='Path to save the processed CSV')
+    parser.add_argument('--output', default='chi_input.parquet',
+                        help='Path to save the token cache (.parquet) or the processed CSV (.csv)')
     parser.add_argument('--stopwords', default='../Assignment_1_Assets/stopwords.txt', help='Path to stopwords file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='processes tokenizing chunks in parallel (default: number of cores)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='reviews per chunk')
     args = parser.parse_args()
 
-    print(f"Loading data from {args.input}")
-    try:
-        df = pd.read_json(args.input, lines = True)
-    except Exception as e:
-        print(f"Error reading input CSV: {e}")
-        sys.exit(1)
-
     stopwords = load_stopwords(args.stopwords)
 
+    print(f"Loading data from {args.input}")
     print("Preprocessing...")
-    df_processed = preprocess(df, stopwords, text_columns=['reviewText', 'summary'])
-
+    # the output is written to a partial file first, a failed run leaves the previous
+    # output (or none) behind instead of a truncated one
+    partial = partial_path(args.output)
     try:
-        df_processed.to_csv(args.output, index=False, columns=['reviewText_tokens', 'category'])
+        if args.output.endswith('.parquet'):
+            # an up-to-date cache of the same input is not tokenized again
+            if read_metadata(args.output) == token_cache_source(args.input):
+                print(f"Token cache {args.output} is up to date")
+                return
+            write_token_cache(args.input, partial, args.workers, args.chunk_size)
+            # vocabulary first, a cache next to an outdated vocabulary never looks up to date
+            os.replace(vocabulary_path(partial), vocabulary_path(args.output))
+            os.replace(partial, args.output)
+            print(f"Token cache saved to {args.output}")
+            return
+        with open(partial, 'w', newline='', encoding='utf-8') as out:
+            chunks = ((lines, i == 0) for i, lines in enumerate(read_chunks(args.input, args.chunk_size)))
+            for text in process_chunks(csv_chunk, chunks, stopwords, args.workers):
+                out.write(text)
+        os.replace(partial, args.output)
         print(f"Processed data saved to {args.output}")
-    except Exception as e:
-        print(f"Error saving output CSV: {e}")
+    except (OSError, ValueError, ImportError) as e:
+        print(f"Error processing {args.input}: {e}")
         sys.exit(1)
+    finally:
+        remove_files(partial, vocabulary_path(partial))
 
 if __name__ == '__main__':
     main()
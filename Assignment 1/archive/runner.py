@@ -1,71 +1,93 @@
-import sys
-import pandas as pd
+import csv
 import argparse
 from calculate_chi_square import ChiSquareUnigrams
 
+import src_path
+from chi_kernel import TopK
+from token_cache import vocabulary_path
 
-def run_job(input_path):
-    with open(input_path, 'r', encoding='utf-8') as f:
-        header_line = f.readline().strip()
 
-    args = [
-        input_path,
-        '--csv-header', header_line
-    ]
+# stopword list of the assignment, removed while counting a token cache
+STOPWORDS = '../Assignment_1_Assets/stopwords.txt'
 
-    results = []
-    job = ChiSquareUnigrams(args=args)
-    with job.make_runner() as runner:
-        runner.run()
-        for (token, category), stats in job.parse_output(runner.cat_output()):
-            results.append({
-                'token': token,
-                'category': category,
-                'observed': stats['observed'],
-                'expected': stats['expected'],
-                'chi_square': stats['chi_square'],
-                'total_term': stats['total_term'],
-                'total_category': stats['total_category']
-            })
-
-    return pd.DataFrame(results)
-
-
-def save_output(df: pd.DataFrame):
+FULL_RESULTS_COLUMNS = ['token', 'category', 'observed', 'expected', 'chi_square',
+                        'total_term', 'total_category']
 
-    top75 = (df.sort_values(['category', 'chi_square'], ascending=[True, False])
-             .groupby('category').head(75))
 
+def run_job(input_path, stopwords=None, k=75, full_results=None):
+    # top k per category, streamed from the job output; every result row is also written to
+    # the full_results file as it arrives
+    if input_path.endswith('.parquet'):
+        # token cache written by preprocessing.py, streamed by the job without re-tokenizing;
+        # the cache still holds the stopwords, so they have to be removed here
+        if not stopwords:
+            raise ValueError(f"{input_path} is a token cache with stopwords, pass the stopwords file")
+        args = [input_path, '--token-vocab', vocabulary_path(input_path)]
+    else:
+        with open(input_path, 'r', encoding='utf-8') as f:
+            header_line = f.readline().strip()
+
+        args = [
+            input_path,
+            '--csv-header', header_line
+        ]
+    if stopwords:
+        args += ['--stopwords', stopwords]
+
+    tops = {}
+    out = writer = None
+    job = ChiSquareUnigrams(args=args)
+    try:
+        with job.make_runner() as runner:
+            runner.run()
+            for (token, category), stats in job.parse_output(runner.cat_output()):
+                top = tops.get(category)
+                if top is None:
+                    top = tops[category] = TopK(k, stats['total_docs'], stats['total_category'])
+                top.add(token, stats['observed'], stats['total_term'])
+                if full_results:
+                    if writer is None:
+                        # opened with the first row, an empty result writes no file
+                        out = open(full_results, 'w', newline='', encoding='utf-8')
+                        writer = csv.writer(out, delimiter='\t', lineterminator='\n')
+                        writer.writerow(FULL_RESULTS_COLUMNS)
+                    writer.writerow([token, category] + [stats[c] for c in FULL_RESULTS_COLUMNS[2:]])
+    finally:
+        if out is not None:
+            out.close()
+
+    return tops
+
+
+def save_output(tops, k=75):
     with open("output.txt", "w", encoding="utf-8") as f:
-        for category in sorted(top75['category'].unique()):
-            terms = top75[top75['category'] == category]
-            line = f"{category} " + ' '.join(
-                f"{row['token']}:{round(row['chi_square'], 3)}"
-                for _, row in terms.iterrows()
-            )
+        merged = set()
+        for category in sorted(tops):
+            best = tops[category].result()
+            line = f"{category} " + ' '.join(f"{t}:{round(v, 3)}" for t, v in best)
+            merged.update(t for t, _ in best)
             f.write(line.strip() + "\n")
 
-        merged = sorted(set(top75['token']))
-        f.write(" ".join(merged) + "\n")
-
-        print("Top 75 terms per category and merged dictionary written to output.txt")
+        f.write(" ".join(sorted(merged)) + "\n")
 
-def save_output_full(df: pd.DataFrame):
-    df.to_csv('chi_square_results.txt', sep='\t', index=False, encoding='utf-8')
-    print(f"Full results saved to: chi_square_results.txt")
+        print(f"Top {k} terms per category and merged dictionary written to output.txt")
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input_csv", help="Path to the input CSV file")
+    parser.add_argument("--input_csv", help="Path to the token cache (.parquet) or the input CSV file")
+    parser.add_argument("--stopwords", default=STOPWORDS,
+                        help="Stopwords removed from the tokens, needed for a token cache (default: the assignment list)")
+    parser.add_argument("--top_k", type=int, default=75, help="Number of terms kept per category")
     parser.add_argument("--save_full_results", action="store_true")
 
     args = parser.parse_args()
 
-    df = run_job(args.input_csv)
+    full_results = 'chi_square_results.txt' if args.save_full_results else None
+    tops = run_job(args.input_csv, args.stopwords, args.top_k, full_results)
 
-    if not df.empty:
-        save_output(df)
-        if args.save_full_results:
-            save_output_full(df)
+    if tops:
+        save_output(tops, args.top_k)
+        if full_results:
+            print(f"Full results saved to: {full_results}")
     else:
-        print("No results to process or save.")
\ No newline at end of file
+        print("No results to process or save.")
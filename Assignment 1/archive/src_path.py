@@ -0,0 +1,11 @@
+"""
+Puts the final solution's src directory on sys.path, so the archived scripts share its
+modules (tokenizer, review reader, chi-square kernel, token cache). Jobs ship this file
+with their FILES; on a cluster node the modules are shipped next to it.
+"""
+import os
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
@@ -0,0 +1,109 @@
+"""
+Error, speed and shuffle volume of the approximate mode of ChiSquareCalculator
+(--approximate, optionally --exact-recount) against the exact job.
+
+Every configuration runs the job in-process on the inline runner. The shuffle volume is
+the JSON size of the first step's map output, measured with the job's own step
+functions (for --exact-recount only its sketch pass). Errors compare each category's
+top-K with the exact one: the share of exact top-K terms found, and the largest
+relative chi-square error of the terms found.
+
+    python bench_approximate.py --stopwords ../Assignment_1_Assets/stopwords.txt ../Assignment_1_Assets/reviews_devset.json
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from mrjob.protocol import JSONProtocol
+
+from chi_square_calculator import ChiSquareCalculator
+from review_reader import read_range
+
+
+def run(job_args):
+    # (output lines, seconds) of one in-process run
+    job = ChiSquareCalculator(job_args + ['-q'])
+    job.sandbox(stdout=io.BytesIO())
+    start = time.perf_counter()
+    job.execute()
+    seconds = time.perf_counter() - start
+    return job.stdout.getvalue().decode('utf-8').splitlines(), seconds
+
+
+def map_output_bytes(job_args, path):
+    # JSON bytes of the first step's map output, after in-mapper combining
+    job = ChiSquareCalculator(job_args)
+    job.increment_counter = lambda *args: None
+    step = job.steps()[0]
+    read = job.input_protocol().read
+    write = JSONProtocol().write
+    step['mapper_init']()
+    size = 0
+    for line in read_range(path):
+        for k, v in step['mapper'](*read(line)):
+            size += len(write(k, v)) + 1
+    for k, v in step['mapper_final']():
+        size += len(write(k, v)) + 1
+    return size
+
+
+def rankings(lines):
+    # {category: {term: chi-square}} of the output lines
+    ranked = {}
+    for line in lines[:-1]:
+        cat, *pairs = line.split(' ')
+        ranked[cat] = {t: float(v) for t, v in (p.rsplit(':', 1) for p in pairs)}
+    return ranked
+
+
+def compare(exact, approx):
+    # (mean recall, worst recall, max relative chi-square error) of the top-K lists
+    recalls, errors = [], [0.0]
+    for cat, best in exact.items():
+        found = approx.get(cat, {})
+        shared = best.keys() & found.keys()
+        recalls.append(len(shared) / len(best))
+        errors.extend(abs(found[t] - best[t]) / best[t] for t in shared if best[t])
+    return sum(recalls) / len(recalls), min(recalls), max(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='review JSON-lines file, e.g. reviews_devset.json')
+    parser.add_argument('--stopwords')
+    parser.add_argument('--widths', default='4096,16384,65536', help='comma-separated sketch widths')
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--candidates', default='500,2000', help='comma-separated heavy hitters per category')
+    args = parser.parse_args()
+
+    base = [args.input]
+    if args.stopwords:
+        base += ['--stopwords', args.stopwords]
+
+    configs = [('exact', base)]
+    for width in map(int, args.widths.split(',')):
+        for candidates in map(int, args.candidates.split(',')):
+            configs.append((f"w={width} c={candidates}",
+                            base + ['--approximate', '--sketch-width', str(width),
+                                    '--sketch-depth', str(args.depth),
+                                    '--candidates', str(candidates)]))
+    for candidates in map(int, args.candidates.split(',')):
+        configs.append((f"recount c={candidates}",
+                        base + ['--approximate', '--exact-recount', '--candidates', str(candidates)]))
+
+    print(f"{'mode':<22} {'seconds':>8} {'map out bytes':>14} {'recall':>7} {'worst':>7} {'max rel err':>12}")
+    exact = None
+    for name, job_args in configs:
+        lines, seconds = run(job_args)
+        shuffle = map_output_bytes([a for a in job_args if a != '--exact-recount'], args.input)
+        if exact is None:
+            exact = rankings(lines)
+        recall, worst, error = compare(exact, rankings(lines))
+        print(f"{name:<22} {seconds:>8.2f} {shuffle:>14,} {recall:>7.3f} {worst:>7.3f} {error:>12.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Docs/sec of decoding the three mapper fields (category, reviewText, summary)
+with json, ujson (if installed) and the field-selective review_decoder.
+
+    python bench_decode.py ../Assignment_1_Assets/reviews_devset.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from review_decoder import FIELDS, decode_review
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def full_decoder(loads):
+    # full parse, None for lines the job skips (not JSON or not an object)
+    def decode(line):
+        try:
+            doc = loads(line)
+        except ValueError:
+            return None
+        if not isinstance(doc, dict):
+            return None
+        return tuple(doc.get(f, '') for f in FIELDS)
+    return decode
+
+
+def bench(decode, lines, repeat):
+    # best of `repeat` passes over all lines, in docs/sec
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            decode(line)
+        best = min(best, time.perf_counter() - start)
+    return len(lines) / best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='review JSON-lines file, e.g. reviews_devset.json')
+    parser.add_argument('--limit', type=int, default=None, help='only use the first N reviews')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with open(args.input, 'rb') as f:
+        lines = [line.rstrip(b'\n') for line in f if line.strip()]
+    if args.limit:
+        lines = lines[:args.limit]
+
+    candidates = [('json.loads', full_decoder(json.loads))]
+    if ujson is not None:
+        candidates.append(('ujson.loads', full_decoder(ujson.loads)))
+    candidates.append(('review_decoder', decode_review))
+
+    # every variant has to agree with json before it is timed
+    reference = [full_decoder(json.loads)(line) for line in lines]
+    for name, decode in candidates:
+        if [decode(line) for line in lines] != reference:
+            sys.exit(f"{name} disagrees with json.loads")
+
+    skipped = reference.count(None)
+    print(f"{len(lines)} reviews ({skipped} malformed, skipped by every decoder), "
+          f"{sum(map(len, lines)) / 1e6:.1f} MB")
+    baseline = None
+    for name, decode in candidates:
+        rate = bench(decode, lines, args.repeat)
+        baseline = baseline or rate
+        print(f"{name:<16} {rate:>12,.0f} docs/sec  {rate / baseline:5.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""
+End-to-end benchmark of the chi-square implementations of the repository on synthetic
+corpora (see synthetic_corpus.py).
+
+Every implementation runs as its own process on the same corpus, the archived pipelines
+after preprocessing.py (CSV or Parquet token cache, timed separately). For every run
+the results record the wall time, the peak RSS of the process and its children,
+documents per second and, for mrjob jobs, the bytes of every step's shuffle (reducer
+input) and output, read from the job's working directory (kept through an mrjob.conf
+with cleanup: NONE). The top-K lists are compared with those of the final solution:
+category lines must hold the same scores within rounding and the same terms except
+for ties at the cut. The merged dictionary line is not compared, some archived jobs
+write every term into it. The Spark notebooks are not run.
+
+Results go to a JSON file, a summary table to stderr:
+
+    python bench_end_to_end.py --docs 2000,20000 --output results.json
+    python bench_end_to_end.py --docs 50000 --implementations src,src-multiprocess,bonkers2
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from synthetic_corpus import generate
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SRC = os.path.join(ROOT, 'src')
+ARCHIVE = os.path.join(ROOT, 'archive')
+STOPWORDS = os.path.join(ROOT, 'Assignment_1_Assets', 'stopwords.txt')
+# window of stream_chi_square.py spanning any synthetic corpus
+_WHOLE_WINDOW = str(10 ** 12)
+
+
+def _script(directory, name):
+    return [sys.executable, os.path.join(directory, name)]
+
+
+# name: (input kind, command for {'json', 'csv', 'parquet', 'csv_header', 'stopwords'},
+#        where the top-K lists are written)
+IMPLEMENTATIONS = {
+    'src': ('json', lambda p: _script(SRC, 'chi_square_calculator.py') + [
+        '--stopwords', p['stopwords'], p['json']], 'stdout'),
+    'src-multiprocess': ('json', lambda p: _script(SRC, 'chi_square_calculator.py') + [
+        '--engine', 'multiprocess', '--stopwords', p['stopwords'], p['json']], 'stdout'),
+    'src-stream': ('json', lambda p: _script(SRC, 'stream_chi_square.py') + [
+        '--window', _WHOLE_WINDOW, '--slide', _WHOLE_WINDOW, '--stopwords', p['stopwords'],
+        p['json']], 'stdout'),
+    'bonkers2': ('json', lambda p: _script(ARCHIVE, 'bonkers2.py') + [
+        '--stopwords', p['stopwords'], p['json']], 'stdout'),
+    'combined': ('json', lambda p: _script(ARCHIVE, 'combined.py') + [
+        '--stopwords', p['stopwords'], p['json']], 'stdout'),
+    'mapreduce_chi_square': ('csv', lambda p: _script(ARCHIVE, 'mapreduce_chi_square.py') + [
+        p['csv'], '--csv-header', p['csv_header']], 'output.txt'),
+    'test_marcus': ('csv', lambda p: _script(ARCHIVE, 'test_marcus.py') + [p['csv']], 'output.txt'),
+    'runner-csv': ('csv', lambda p: _script(ARCHIVE, 'runner.py') + [
+        '--input_csv', p['csv']], 'output.txt'),
+    'runner-parquet': ('parquet', lambda p: _script(ARCHIVE, 'runner.py') + [
+        '--input_csv', p['parquet'], '--stopwords', p['stopwords']], 'output.txt'),
+}
+
+
+def run_process(command, cwd, env, timeout):
+    # (seconds, peak RSS in bytes, exit status) of a command including its children
+    with open(os.path.join(cwd, 'stdout'), 'wb') as out, \
+            open(os.path.join(cwd, 'stderr'), 'wb') as err:
+        start = time.perf_counter()
+        proc = subprocess.Popen(command, cwd=cwd, env=env, stdout=out, stderr=err)
+        timer = threading.Timer(timeout, proc.kill)
+        timer.start()
+        try:
+            # wait4 gives the resource usage of this child alone
+            _, status, usage = os.wait4(proc.pid, 0)
+        finally:
+            timer.cancel()
+        seconds = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux
+    return seconds, usage.ru_maxrss * 1024, proc.returncode
+
+
+def step_bytes(tmp_dir):
+    # [{'step', 'shuffle_bytes', 'output_bytes'}] summed over the mrjob jobs of a run
+    steps = {}
+
+    def add(step, field, pattern):
+        size = sum(os.path.getsize(p) for p in glob.glob(pattern))
+        entry = steps.setdefault(step, {'step': step + 1, 'shuffle_bytes': 0, 'output_bytes': 0})
+        entry[field] += size
+
+    for job_dir in glob.glob(os.path.join(tmp_dir, '*')):
+        # step directories count from 000, the last step writes to output/
+        numbers = sorted(int(os.path.basename(d)) for d in glob.glob(os.path.join(job_dir, 'step', '[0-9]*')))
+        for n in numbers:
+            add(n, 'shuffle_bytes', os.path.join(job_dir, 'step', f"{n:03d}", 'reducer', '[0-9]*', 'input'))
+            if n < numbers[-1]:
+                add(n, 'output_bytes', os.path.join(job_dir, 'step-output', f"{n:04d}", 'part-*'))
+            else:
+                add(n, 'output_bytes', os.path.join(job_dir, 'output', 'part-*'))
+    return [steps[n] for n in sorted(steps)]
+
+
+def rankings(lines):
+    # {category: [(term, score), ...]} of the category lines (all but the merged dictionary)
+    ranked = {}
+    lines = [line for line in lines if line.strip() and not line.startswith('# ')]
+    for line in lines[:-1]:
+        cat, *pairs = line.split()
+        ranked[cat] = [(t, float(v)) for t, v in (p.rsplit(':', 1) for p in pairs)]
+    return ranked
+
+
+def mismatch(expected, got, tolerance=1.1e-3):
+    # reason why two rankings differ, None if they agree up to rounding and ties at the cut
+    if expected.keys() != got.keys():
+        return f"categories differ: {sorted(expected.keys() ^ got.keys())[:5]}"
+    for cat, best in expected.items():
+        other = got[cat]
+        if len(best) != len(other):
+            return f"{cat}: {len(other)} terms instead of {len(best)}"
+        for (t, v), (u, w) in zip(best, other):
+            if abs(v - w) > tolerance + 1e-9 * abs(v):
+                return f"{cat}: {u}:{w} where {t}:{v} was expected"
+        if best:
+            cut = best[-1][1] + tolerance
+            above = {t for t, v in best if v > cut}
+            if above != {t for t, v in other if v > cut}:
+                return f"{cat}: different terms above the cut"
+    return None
+
+
+def mrjob_conf(path, tmp_dir):
+    # mrjob.conf keeping the working directory of the inline and local runners
+    options = {'local_tmp_dir': tmp_dir, 'cleanup': 'NONE'}
+    with open(path, 'w') as f:
+        json.dump({'runners': {'inline': options, 'local': options}}, f)
+
+
+def run(name, command, cwd, docs, timeout):
+    # one run of a command with its measurements
+    tmp_dir = os.path.join(cwd, 'mrjob')
+    os.makedirs(tmp_dir)
+    conf = os.path.join(cwd, 'mrjob.conf')
+    mrjob_conf(conf, tmp_dir)
+    env = dict(os.environ, MRJOB_CONF=conf)
+    seconds, rss, status = run_process(command, cwd, env, timeout)
+    return {
+        'name': name,
+        'command': command,
+        'exit_status': status,
+        'seconds': round(seconds, 3),
+        'peak_rss_bytes': rss,
+        'docs_per_sec': round(docs / seconds, 1) if seconds else None,
+        'steps': step_bytes(tmp_dir),
+    }
+
+
+def benchmark_corpus(work_dir, docs, names, args):
+    # results of every implementation on one generated corpus
+    corpus_dir = os.path.join(work_dir, f"docs-{docs}")
+    os.makedirs(corpus_dir)
+    paths = {'json': os.path.join(corpus_dir, 'reviews.json'), 'stopwords': args.stopwords,
+             'csv': os.path.join(corpus_dir, 'chi_input.csv'),
+             'parquet': os.path.join(corpus_dir, 'chi_input.parquet')}
+    corpus = generate(paths['json'], docs, args.categories, args.vocabulary, args.term_skew,
+                      args.category_skew, seed=args.seed)
+    results = []
+
+    # preprocessing for the archived pipelines, run once per input kind
+    for kind in sorted({IMPLEMENTATIONS[n][0] for n in names} - {'json'}):
+        cwd = os.path.join(corpus_dir, f"preprocessing-{kind}")
+        os.makedirs(cwd)
+        command = _script(ARCHIVE, 'preprocessing.py') + [
+            '--input', paths['json'], '--output', paths[kind], '--stopwords', args.stopwords]
+        result = run(f"preprocessing-{kind}", command, cwd, docs, args.timeout)
+        results.append(result)
+        log(result)
+    if os.path.exists(paths['csv']):
+        with open(paths['csv'], encoding='utf-8') as f:
+            paths['csv_header'] = f.readline().strip()
+
+    reference = None
+    for name in names:
+        kind, command, output = IMPLEMENTATIONS[name]
+        cwd = os.path.join(corpus_dir, name)
+        os.makedirs(cwd)
+        result = run(name, command(paths), cwd, docs, args.timeout)
+        output_path = os.path.join(cwd, output)
+        if result['exit_status'] == 0 and os.path.exists(output_path):
+            with open(output_path, encoding='utf-8') as f:
+                ranked = rankings(f.read().splitlines())
+            if reference is None:
+                reference = (name, ranked)
+                result['matches'] = None
+            else:
+                result['reference'] = reference[0]
+                reason = mismatch(reference[1], ranked)
+                result['matches'] = reason is None
+                if reason:
+                    result['mismatch'] = reason
+        results.append(result)
+        log(result)
+    return {'corpus': corpus, 'results': results}
+
+
+def log(result):
+    steps = sum(s['shuffle_bytes'] for s in result['steps'])
+    matches = {True: 'yes', False: 'NO', None: '-'}[result.get('matches')]
+    sys.stderr.write(f"{result['name']:<22} {result['exit_status']:>4} {result['seconds']:>9.2f} "
+                     f"{result['peak_rss_bytes'] / 2 ** 20:>9.1f} {result['docs_per_sec'] or 0:>11,.0f} "
+                     f"{steps:>14,} {matches:>7}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', default='2000,20000', help='comma-separated corpus sizes')
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--vocabulary', type=int, default=50000)
+    parser.add_argument('--term-skew', type=float, default=1.1)
+    parser.add_argument('--category-skew', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--implementations', default=','.join(IMPLEMENTATIONS),
+                        help='comma-separated subset of ' + ', '.join(IMPLEMENTATIONS))
+    parser.add_argument('--stopwords', default=STOPWORDS)
+    parser.add_argument('--timeout', type=float, default=3600, help='seconds per run')
+    parser.add_argument('--work-dir', default=None, help='keep corpora and job directories here')
+    parser.add_argument('--output', default=None, help='JSON results file (default: stdout)')
+    args = parser.parse_args()
+
+    names = args.implementations.split(',')
+    unknown = [n for n in names if n not in IMPLEMENTATIONS]
+    if unknown:
+        parser.error(f"unknown implementations {', '.join(unknown)}")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='chi-square-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    report = {'python': sys.version.split()[0], 'runs': []}
+    try:
+        for docs in map(int, args.docs.split(',')):
+            sys.stderr.write(f"\n{docs} documents\n{'implementation':<22} {'exit':>4} {'seconds':>9} "
+                             f"{'RSS MB':>9} {'docs/sec':>11} {'shuffle bytes':>14} {'matches':>7}\n")
+            report['runs'].append(benchmark_corpus(work_dir, docs, names, args))
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
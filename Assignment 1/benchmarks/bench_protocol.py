@@ -0,0 +1,104 @@
+"""
+Serialization time and bytes of the intermediate records of every ChiSquareCalculator
+step, mrjob's JSONProtocol versus the compact binary protocol.
+
+The records are produced by running the job's own step functions in memory over the
+input, so every step boundary (map output / shuffle and step output) is measured with
+realistic keys and values.
+
+    python bench_protocol.py --stopwords ../Assignment_1_Assets/stopwords.txt ../Assignment_1_Assets/reviews_devset.json
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from mrjob.protocol import JSONProtocol
+
+from chi_square_calculator import ChiSquareCalculator
+from protocols import CompactProtocol
+from review_reader import read_range
+
+
+def step_records(job, path):
+    # (name, records) for the map output and the reduce output of every step
+    steps = job.steps()
+    read = job.input_protocol().read
+    pairs = [read(line) for line in read_range(path)]
+    boundaries = []
+    for num, step in enumerate(steps, 1):
+        if step['mapper_init']:
+            step['mapper_init']()
+        mapped = [kv for k, v in pairs for kv in step['mapper'](k, v)]
+        if step['mapper_final']:
+            mapped.extend(step['mapper_final']() or ())
+        boundaries.append((f"step {num} map output", mapped))
+
+        groups = {}
+        for k, v in mapped:
+            groups.setdefault(k, []).append(v)
+        if step['reducer_init']:
+            step['reducer_init']()
+        pairs = [kv for k, vs in groups.items() for kv in step['reducer'](k, iter(vs))]
+        if num < len(steps):
+            boundaries.append((f"step {num} output", pairs))
+    return boundaries
+
+
+def _tuples(obj):
+    # JSON gives lists where the compact protocol gives tuples
+    if isinstance(obj, (list, tuple)):
+        return tuple(_tuples(item) for item in obj)
+    return obj
+
+
+def measure(protocol, records, repeat):
+    # (bytes, best write seconds, best read seconds) for one list of records
+    best_write = best_read = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        lines = [protocol.write(k, v) for k, v in records]
+        best_write = min(best_write, time.perf_counter() - start)
+        start = time.perf_counter()
+        for line in lines:
+            protocol.read(line)
+        best_read = min(best_read, time.perf_counter() - start)
+    return sum(len(line) + 1 for line in lines), best_write, best_read
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='review JSON-lines file, e.g. reviews_devset.json')
+    parser.add_argument('--stopwords')
+    parser.add_argument('--id-dictionary')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    job_args = [args.input]
+    if args.stopwords:
+        job_args += ['--stopwords', args.stopwords]
+    if args.id_dictionary:
+        job_args += ['--id-dictionary', args.id_dictionary]
+    job = ChiSquareCalculator(job_args)
+
+    protocols = [('json', JSONProtocol()), ('compact', CompactProtocol())]
+    print(f"{'boundary':<20} {'records':>9} {'protocol':>9} {'bytes':>12} {'write s':>9} {'read s':>9}")
+    totals = {name: [0, 0.0, 0.0] for name, _ in protocols}
+    for name, records in step_records(job, args.input):
+        for proto_name, protocol in protocols:
+            # every protocol has to round-trip the records before it is timed
+            for k, v in records:
+                if _tuples(protocol.read(protocol.write(k, v))) != _tuples((k, v)):
+                    sys.exit(f"{proto_name} does not round-trip {k!r}, {v!r}")
+            size, write_s, read_s = measure(protocol, records, args.repeat)
+            totals[proto_name][0] += size
+            totals[proto_name][1] += write_s
+            totals[proto_name][2] += read_s
+            print(f"{name:<20} {len(records):>9} {proto_name:>9} {size:>12,} {write_s:>9.3f} {read_s:>9.3f}")
+    for proto_name, (size, write_s, read_s) in totals.items():
+        print(f"{'total':<20} {'':>9} {proto_name:>9} {size:>12,} {write_s:>9.3f} {read_s:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Tokens/sec of the tokenizer variants found in the Python entry points versus the shared
+tokenizer module, on reviewText + ' ' + summary of every review.
+
+The archived scripts split at '$' and non-ASCII digits as well, so every variant is
+checked against the reference of its own delimiter set before it is timed.
+
+    python bench_tokenize.py ../Assignment_1_Assets/reviews_devset.json
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from review_decoder import decode_review
+from review_reader import read_range
+from tokenizer import DELIMITERS, REGEX_DELIMITERS, Tokenizer
+
+_REGEX_CHARS = r'()\[\]{}.!?,;:+=\-_"\'`~#@&*%€$§\\/'
+_TRANSLATOR = str.maketrans({c: ' ' for c in DELIMITERS})
+
+
+def regex_rebuilt(text):
+    # archived preprocessing.py, hadoop_preprocessing.py and combined.py
+    split_pattern = rf'[\s\d{re.escape(_REGEX_CHARS)}]+'
+    return [t for t in re.split(split_pattern, text.lower()) if t]
+
+
+_SPLIT = re.compile(rf'[\s\d{re.escape(_REGEX_CHARS)}]+')
+
+
+def regex_compiled(text):
+    return [t for t in _SPLIT.split(text.lower()) if t]
+
+
+def translate_split(text):
+    # former ChiSquareCalculator.mapper and bonkers2.py
+    return text.lower().translate(_TRANSLATOR).split()
+
+
+def per_doc(tokenize):
+    def run(texts):
+        return [tokenize(text) for text in texts]
+    return run
+
+
+def bench(run, texts, repeat):
+    # (tokens, best seconds) of `repeat` passes over all texts
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        token_lists = run(texts)
+        best = min(best, time.perf_counter() - start)
+    return sum(map(len, token_lists)), best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='review JSON-lines file, e.g. reviews_devset.json')
+    parser.add_argument('--limit', type=int, default=None, help='only use the first N reviews')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    texts = []
+    for line in read_range(args.input):
+        fields = decode_review(line)
+        if fields is not None:
+            texts.append(fields[1] + ' ' + fields[2])
+        if args.limit and len(texts) >= args.limit:
+            break
+
+    shared = Tokenizer()
+    regex_compatible = Tokenizer(REGEX_DELIMITERS, unicode_digits=True)
+    groups = [
+        ('regex delimiters', [
+            ('re.split, pattern per call', per_doc(regex_rebuilt)),
+            ('re.split, precompiled', per_doc(regex_compiled)),
+            ('Tokenizer.tokenize', per_doc(regex_compatible.tokenize)),
+            ('Tokenizer.tokenize_batch', regex_compatible.tokenize_batch),
+        ]),
+        ('job delimiters', [
+            ('str.translate + split', per_doc(translate_split)),
+            ('Tokenizer.tokenize', per_doc(shared.tokenize)),
+            ('Tokenizer.tokenize_batch', shared.tokenize_batch),
+        ]),
+    ]
+
+    print(f"{len(texts)} reviews, {sum(map(len, texts)) / 1e6:.1f} M characters")
+    for group, candidates in groups:
+        # every variant has to give the tokens of the first one before it is timed
+        reference = candidates[0][1](texts)
+        for name, run in candidates:
+            if run(texts) != reference:
+                sys.exit(f"{name} disagrees with {candidates[0][0]} ({group})")
+
+        print(group)
+        baseline = None
+        for name, run in candidates:
+            tokens, seconds = bench(run, texts, args.repeat)
+            rate = tokens / seconds
+            baseline = baseline or rate
+            print(f"  {name:<28} {rate:>14,.0f} tokens/sec  {rate / baseline:5.2f}x")
+
+
+if __name__ == '__main__':
+    main()
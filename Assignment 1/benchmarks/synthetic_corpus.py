@@ -0,0 +1,108 @@
+"""
+Synthetic review corpora in the JSON-lines format of the Amazon review dataset.
+
+Categories get documents in proportion to 1 / rank ** category_skew. Every review draws
+its words from a Zipf distribution over the vocabulary (1 / rank ** term_skew); a share
+`topical` of them instead come from a small set of terms of its own category, so every
+category has terms with a clear chi-square signal. Words consist of ASCII letters only,
+so every tokenizer of the repository splits them alike. Reviews are ordered by
+unixReviewTime, one every `interval` seconds.
+
+    python synthetic_corpus.py --docs 100000 --categories 20 --vocabulary 50000 corpus.json
+"""
+import argparse
+import json
+import string
+
+import numpy as np
+
+_LETTERS = np.array(list(string.ascii_lowercase))
+# reviews generated per batch of vectorized draws
+_BATCH = 10000
+START_TIME = 1300000000
+
+
+def vocabulary_words(rng, size):
+    # distinct random lower-case words of 3 to 10 letters
+    words = set()
+    while len(words) < size:
+        n = size - len(words)
+        lengths = rng.integers(3, 11, n)
+        letters = _LETTERS[rng.integers(0, len(_LETTERS), lengths.sum())]
+        words.update(''.join(w) for w in np.split(letters, np.cumsum(lengths)[:-1]))
+    return sorted(words)[:size]
+
+
+def zipf_weights(n, skew):
+    weights = 1.0 / np.arange(1, n + 1) ** skew
+    return weights / weights.sum()
+
+
+def generate(path, docs, categories=20, vocabulary=50000, term_skew=1.1, category_skew=1.0,
+             words=60, topical=0.2, topical_terms=50, interval=60, seed=0):
+    """
+    Writes `docs` synthetic reviews to path and returns a description of the corpus.
+    """
+    rng = np.random.default_rng(seed)
+    vocab = np.array(vocabulary_words(rng, vocabulary), dtype=object)
+    # frequent words get low ranks, the order is random with respect to the spelling
+    term_p = zipf_weights(vocabulary, term_skew)[rng.permutation(vocabulary)]
+    cat_names = [f"Category_{i:02d}" for i in range(categories)]
+    cat_p = zipf_weights(categories, category_skew)
+    topics = rng.integers(0, vocabulary, (categories, topical_terms))
+    topic_p = zipf_weights(topical_terms, 1.0)
+
+    size = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for first in range(0, docs, _BATCH):
+            n = min(_BATCH, docs - first)
+            cats = rng.choice(categories, n, p=cat_p)
+            lengths = rng.poisson(words, n) + 1
+            owner = np.repeat(cats, lengths)
+            ids = rng.choice(vocabulary, lengths.sum(), p=term_p)
+            on_topic = rng.random(len(ids)) < topical
+            ids[on_topic] = topics[owner[on_topic], rng.choice(topical_terms, on_topic.sum(), p=topic_p)]
+            for i, (cat, text) in enumerate(zip(cats, np.split(vocab[ids], np.cumsum(lengths)[:-1]))):
+                text = list(text)
+                doc = {
+                    'reviewerID': f"A{first + i:08d}",
+                    'asin': f"B{(first + i) % 100000:06d}",
+                    'reviewerName': 'Reviewer',
+                    'helpful': [0, 0],
+                    'reviewText': ' '.join(text).capitalize() + '.',
+                    'overall': float(1 + (first + i) % 5),
+                    'summary': ' '.join(text[:3]).capitalize(),
+                    'unixReviewTime': START_TIME + (first + i) * interval,
+                    'reviewTime': '01 1, 2011',
+                    'category': cat_names[cat],
+                }
+                line = json.dumps(doc) + '\n'
+                size += len(line)
+                f.write(line)
+
+    return {
+        'docs': docs, 'categories': categories, 'vocabulary': vocabulary,
+        'term_skew': term_skew, 'category_skew': category_skew, 'words': words,
+        'topical': topical, 'seed': seed, 'bytes': size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output', help='JSON-lines file to write')
+    parser.add_argument('--docs', type=int, default=100000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--vocabulary', type=int, default=50000)
+    parser.add_argument('--term-skew', type=float, default=1.1, help='Zipf exponent of the terms')
+    parser.add_argument('--category-skew', type=float, default=1.0, help='Zipf exponent of the category sizes')
+    parser.add_argument('--words', type=int, default=60, help='mean words per review')
+    parser.add_argument('--topical', type=float, default=0.2, help='share of category-specific words')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    info = generate(args.output, args.docs, args.categories, args.vocabulary, args.term_skew,
+                    args.category_skew, args.words, args.topical, seed=args.seed)
+    print(json.dumps(info))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+Shared chi-square kernel.
+
+Works on array-backed columns of A (documents of the category containing the term),
+term totals and category doc counts, and selects the top k terms per category.
+Falls back to plain Python when numpy is not installed (e.g. on bare Hadoop nodes).
+
+Besides chi-square, terms can be ranked by other association scores of the same counts
+(see STATISTICS). Those use the term/category contingency table A, T - A, C - A and
+N - C - T + A; chi-square keeps the cells of ChiSquareCalculator (see contingency) so
+its output does not change.
+"""
+import json
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def chi_square_scalar(A, B, C, D):
+    # reference formula on a single 2x2 contingency table, None when undefined
+    N = A + B + C + D
+    denom = (A+B)*(C+D)*(A+C)*(B+D)
+    if denom == 0:
+        return None
+    return N * (A*D - B*C)**2 / denom
+
+
+def chi_square(A, B, C, D):
+    """
+    Vectorized chi-square over columns of contingency cells.
+    Entries with a zero denominator are NaN.
+    """
+    A = np.asarray(A, dtype=np.int64)
+    B = np.asarray(B, dtype=np.int64)
+    C = np.asarray(C, dtype=np.int64)
+    D = np.asarray(D, dtype=np.int64)
+    N = (A + B + C + D).astype(np.float64)
+    # A*D and B*C stay exact in int64 for any realistic corpus, the square does not
+    diff = (A*D - B*C).astype(np.float64)
+    denom = ((A+B).astype(np.float64) * (C+D).astype(np.float64)
+             * (A+C).astype(np.float64) * (B+D).astype(np.float64))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2 = N * diff * diff / denom
+    chi2[denom == 0] = np.nan
+    return chi2
+
+
+def contingency(A, T, C, N):
+    """
+    Cells used by ChiSquareCalculator: A, B = T - A, C = category doc count
+    and D = N - C - B - A, for term totals T and corpus size N.
+    """
+    A = np.asarray(A, dtype=np.int64)
+    B = np.asarray(T, dtype=np.int64) - A
+    C = np.broadcast_to(np.asarray(C, dtype=np.int64), A.shape)
+    D = N - C - B - A
+    return A, B, C, D
+
+
+def chi_square_columns(A, T, C, N):
+    # chi-square for the ChiSquareCalculator cell layout, NaN where undefined
+    return chi_square(*contingency(A, T, C, N))
+
+
+def _table(A, T, C, N):
+    # float cells and margins of the term/category contingency table
+    A = np.asarray(A, dtype=np.float64)
+    T = np.asarray(T, dtype=np.float64)
+    C = np.broadcast_to(np.asarray(C, dtype=np.float64), A.shape)
+    cells = (A, T - A, C - A, N - C - T + A)
+    margins = ((T, C), (T, N - C), (N - T, C), (N - T, N - C))
+    return cells, margins
+
+
+def _information(A, T, C, N):
+    # sum of n * ln(n * N / (row * column)) over the cells, NaN for degenerate tables
+    cells, margins = _table(A, T, C, N)
+    total = np.zeros(cells[0].shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for n, (row, col) in zip(cells, margins):
+            total += np.where(n > 0, n * np.log(n * N / (row * col)), 0.0)
+    T, C = margins[0]
+    total[(T == 0) | (T == N) | (C == 0) | (C == N)] = np.nan
+    return total
+
+
+def mutual_information_columns(A, T, C, N):
+    # mutual information of term and category in bits
+    return _information(A, T, C, N) / (N * math.log(2)) if N else np.full(len(A), np.nan)
+
+
+def log_likelihood_columns(A, T, C, N):
+    # log-likelihood ratio G2 = 2 * N * mutual information in nats
+    return 2 * _information(A, T, C, N)
+
+
+def odds_ratio_columns(A, T, C, N):
+    # odds ratio with 0.5 added to every cell (Haldane-Anscombe), defined for all tables
+    (a, b, c, d), _ = _table(A, T, C, N)
+    return (a + 0.5) * (d + 0.5) / ((b + 0.5) * (c + 0.5))
+
+
+def _information_scalar(A, T, C, N):
+    cells = (A, T - A, C - A, N - C - T + A)
+    margins = ((T, C), (T, N - C), (N - T, C), (N - T, N - C))
+    if T in (0, N) or C in (0, N):
+        return None
+    return sum(n * math.log(n * N / (row * col)) for n, (row, col) in zip(cells, margins) if n > 0)
+
+
+def _chi_square_counts(A, T, C, N):
+    B = T - A
+    return chi_square_scalar(A, B, C, N - C - B - A)
+
+
+def _mutual_information_scalar(A, T, C, N):
+    info = _information_scalar(A, T, C, N)
+    return None if info is None else info / (N * math.log(2))
+
+
+def _log_likelihood_scalar(A, T, C, N):
+    info = _information_scalar(A, T, C, N)
+    return None if info is None else 2 * info
+
+
+def _odds_ratio_scalar(A, T, C, N):
+    return (A + 0.5) * (N - C - T + A + 0.5) / ((T - A + 0.5) * (C - A + 0.5))
+
+
+# name: (vectorized function of A, T, C, N columns, scalar function or None if undefined,
+#        output format of the values)
+STATISTICS = {
+    'chi2': (chi_square_columns, _chi_square_counts, '.3f'),
+    'mi': (mutual_information_columns, _mutual_information_scalar, '.6f'),
+    'g2': (log_likelihood_columns, _log_likelihood_scalar, '.3f'),
+    'odds_ratio': (odds_ratio_columns, _odds_ratio_scalar, '.3f'),
+}
+
+
+def tie_key(term):
+    # ties break by the JSON text of the term, the order of the former sorted shuffle
+    # keys (e.g. 'caf\\u00e9' before 'cafa')
+    return json.dumps(term)
+
+
+def top_k(chi2, terms, k):
+    """
+    Indices of the k best entries by descending chi-square, ties broken by tie_key.
+    NaN entries are never selected.
+    """
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    valid = np.flatnonzero(~np.isnan(chi2))
+    if len(valid) > k:
+        # argpartition finds the k-th best value, every entry tied with it stays a candidate
+        part = np.argpartition(-chi2[valid], k - 1)[:k]
+        kth = chi2[valid[part]].min()
+        valid = valid[chi2[valid] >= kth]
+    values = chi2[valid].tolist()
+    order = sorted(range(len(valid)), key=lambda i: (-values[i], tie_key(terms[valid[i]])))[:k]
+    return valid[order]
+
+
+class TopK(object):
+    """
+    Running top k over blocks of (term, A, term total) rows of one category by one of the
+    STATISTICS. Each block is scored with the vectorized kernel and merged with the
+    current best, so memory stays bounded by the block size plus k.
+    """
+
+    def __init__(self, k, N, C, block_size=65536, statistic='chi2'):
+        self.k = k
+        self.N = N
+        self.C = C
+        self.block_size = block_size
+        self.score, self.score_scalar, _ = STATISTICS[statistic]
+        self.terms = []
+        self.scores = [] if np is None else np.empty(0)
+        self._block = []
+
+    def add(self, term, A, T):
+        self._block.append((term, A, T))
+        if len(self._block) >= self.block_size:
+            self._flush()
+
+    def _flush(self):
+        block, self._block = self._block, []
+        if not block:
+            return
+        if np is None:
+            self._flush_scalar(block)
+            return
+        terms, A, T = zip(*block)
+        scores = np.concatenate([self.scores, self.score(A, T, self.C, self.N)])
+        terms = self.terms + list(terms)
+        best = top_k(scores, terms, self.k)
+        self.terms = [terms[i] for i in best]
+        self.scores = scores[best]
+
+    def _flush_scalar(self, block):
+        scored = list(zip(self.terms, self.scores))
+        N, C = self.N, self.C
+        for term, A, T in block:
+            score = self.score_scalar(A, T, C, N)
+            if score is not None:
+                scored.append((term, score))
+        scored.sort(key=lambda x: (-x[1], tie_key(x[0])))
+        del scored[self.k:]
+        self.terms = [t for t, _ in scored]
+        self.scores = [v for _, v in scored]
+
+    def result(self):
+        # (term, score) pairs of the best k in descending order
+        self._flush()
+        return list(zip(self.terms, [float(v) for v in self.scores]))
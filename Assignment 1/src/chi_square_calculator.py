@@ -1,185 +1,926 @@
+import codecs
+import logging
+import os
+import shutil
 import sys
-try:
-    import ujson as json  # faster JSON parser if available
-except ImportError:
-    import json
+import tempfile
 
 from mrjob.job import MRJob
-from mrjob.step import MRStep
-from mrjob.protocol import RawValueProtocol  
+from mrjob.step import MRStep, StepFailedException
+from mrjob.protocol import BytesValueProtocol, JSONProtocol, RawValueProtocol
+
+from chi_kernel import STATISTICS, TopK
+from combine_cache import AggregationCache
+from id_dictionary import load_id_dictionary
+from partition_plan import PartitionPlan
+from protocols import CompactProtocol
+from review_decoder import FIELDS, decode_review
+from stage_profiler import StageProfiler, clock
+from step_sizing import FIXED, MB, sample_statistics, size_steps
+from stopword_filter import load_stopword_filter
+from tokenizer import TOKENIZER, tokenize
+
+log = logging.getLogger(__name__)
+
+
+def vocabulary_threshold(histogram, max_vocab):
+    # smallest term total among the max_vocab most frequent terms, from {total: number of terms}
+    if not max_vocab:
+        return 0
+    kept = 0
+    for total in sorted(histogram, reverse=True):
+        kept += histogram[total]
+        if kept >= max_vocab:
+            return total
+    return 0
+
 
 class ChiSquareCalculator(MRJob):
+    # raw review bytes, only the needed fields get decoded
+    INPUT_PROTOCOL = BytesValueProtocol
     # final output format will be plain strings without JSON or key prefixes
     OUTPUT_PROTOCOL = RawValueProtocol
-
-    # assignment provided delimiters
-    _DELIMS = r'''()[]{}.!?,;:+=-_"'`~#@&*%€§\\/0123456789'''
-    # translation table to replace delimiters with whitespace
-    TRANSLATOR = str.maketrans({c: ' ' for c in _DELIMS})
+    # sorting values so the broadcast doc counts reach each category reducer first
+    SORT_VALUES = True
+    # shared helper modules shipped next to the job script
+    FILES = ['chi_kernel.py', 'combine_cache.py', 'id_dictionary.py', 'partition_plan.py',
+             'protocols.py', 'review_decoder.py', 'sketches.py', 'stage_profiler.py',
+             'step_sizing.py', 'stopword_filter.py', 'tokenizer.py']
 
     def configure_args(self):
         # adding command-line argument for stopword file
         super(ChiSquareCalculator, self).configure_args()
         self.add_file_arg('--stopwords')
+        self.add_file_arg('--id-dictionary',
+                          help='integer IDs for categories and terms in the shuffle (see id_dictionary.py)')
+        self.add_file_arg('--partition-plan',
+                          help='reducer assignment of terms and categories (see partition_plan.py)')
+        self.add_passthru_arg('--top-k', type=int, default=75,
+                              help='number of terms kept per category')
+        self.add_passthru_arg('--statistics', default='chi2',
+                              help='comma-separated term scores to rank by: ' + ', '.join(STATISTICS))
+        self.add_passthru_arg('--top-ks', default=None,
+                              help='comma-separated numbers of terms per category, instead of --top-k')
+        self.add_passthru_arg('--output-prefix', default=None,
+                              help='write one file PREFIX<statistic>_top<K>.txt per statistic and K '
+                                   'instead of printing the output')
+        self.add_passthru_arg('--engine', choices=['mrjob', 'multiprocess'], default='mrjob',
+                              help='mrjob runner or native multi-process local engine')
+        self.add_passthru_arg('--workers', type=int, default=None,
+                              help='processes for the multiprocess engine (default: all cores)')
+        self.add_passthru_arg('--internal-protocol', choices=['json', 'compact'], default='json',
+                              help='encoding of the records between steps')
+        self.add_passthru_arg('--layout', choices=['four-step', 'two-step'], default='four-step',
+                              help='four MapReduce steps, or two with the final merge done by the driver')
+        self.add_passthru_arg('--combine-max-entries', type=int, default=200000,
+                              help='distinct keys held by the in-mapper combiner (0: unbounded)')
+        self.add_passthru_arg('--combine-max-mb', type=float, default=None,
+                              help='estimated memory of the in-mapper combiner in MB')
+        self.add_passthru_arg('--cache-dir', default=None,
+                              help='reuse stage-1 counts of unchanged inputs (multiprocess engine)')
+        self.add_passthru_arg('--cache-max-mb', type=float, default=1024,
+                              help='size limit of the stage-1 cache directory in MB')
+        self.add_passthru_arg('--snapshot-dir', default=None,
+                              help='merge the inputs into versioned stage-1 snapshots, counting only '
+                                   'files not ingested yet (multiprocess engine)')
+        self.add_passthru_arg('--snapshot-keep', type=int, default=3,
+                              help='number of snapshot versions kept')
+        self.add_passthru_arg('--approximate', action='store_true',
+                              help='rank heavy-hitter candidates by Count-Min sketch estimates '
+                                   'instead of counting every (category, term) pair')
+        self.add_passthru_arg('--sketch-width', type=int, default=1 << 14,
+                              help='counters per Count-Min sketch row')
+        self.add_passthru_arg('--sketch-depth', type=int, default=4,
+                              help='rows per Count-Min sketch')
+        self.add_passthru_arg('--candidates', type=int, default=2000,
+                              help='heavy-hitter terms kept per category')
+        self.add_passthru_arg('--exact-recount', action='store_true',
+                              help='with --approximate, recount the candidate terms exactly')
+        self.add_file_arg('--candidate-file',
+                          help='only count the terms listed in this file, one per line')
+        self.add_passthru_arg('--min-df', type=int, default=1,
+                              help='drop terms found in fewer documents once their totals are known')
+        self.add_passthru_arg('--max-vocab', type=int, default=None,
+                              help='only score the terms of the most documents (ties at the cut are '
+                                   'kept, four-step layout)')
+        self.add_passthru_arg('--sizing', choices=['auto', 'fixed'], default=None,
+                              help='reducer counts and split size from the input (default on cluster '
+                                   'runners, see step_sizing.py) or the former fixed values')
+        self.add_passthru_arg('--reducers', type=int, default=None,
+                              help='reducers of every step instead of the derived counts')
+        self.add_passthru_arg('--max-reducers', type=int, default=32,
+                              help='largest derived reducer count')
+        self.add_passthru_arg('--split-mb', type=float, default=None,
+                              help='input split size instead of the derived one')
+        self.add_passthru_arg('--task-slots', type=int, default=40,
+                              help='map tasks the cluster runs at once, for the derived split size')
+        self.add_passthru_arg('--sizing-sample', type=int, default=20000,
+                              help='reviews sampled for the derived sizes')
+        self.add_passthru_arg('--profile', action='store_true',
+                              help='time mapper phases and reducers, published as counters of the '
+                                   'profile group')
+        self.add_passthru_arg('--profile-sample', type=int, default=100,
+                              help='time every Nth record or reducer key with --profile')
+        self.add_passthru_arg('--profile-trace', default=None,
+                              help='append the profile of every task as a JSON line to this local file')
+
+    def internal_protocol(self):
+        # JSON text or the compact binary protocol between steps
+        if self.options.internal_protocol == 'compact':
+            return CompactProtocol()
+        return JSONProtocol()
+
+    def output_protocol(self):
+        # the two-step layout leaves the merge to the driver and output files are written by
+        # the driver, both need structured step output
+        if (self.options.layout == 'two-step' or self.options.output_prefix) \
+                and not self.options.approximate:
+            return JSONProtocol()
+        return super(ChiSquareCalculator, self).output_protocol()
+
+    def rankings(self):
+        # (statistics, ascending K values) of the output
+        statistics = self.options.statistics.split(',')
+        if self.options.top_ks is not None:
+            return statistics, sorted({int(k) for k in self.options.top_ks.split(',')})
+        return statistics, [self.options.top_k]
+
+    def run_job(self):
+        try:
+            statistics, ks = self.rankings()
+        except ValueError:
+            self.arg_parser.error(f"--top-ks needs comma-separated integers, "
+                                  f"got {self.options.top_ks!r}")
+        unknown = [name for name in statistics if name not in STATISTICS]
+        if unknown:
+            self.arg_parser.error(f"unknown statistics {', '.join(unknown)} "
+                                  f"(choose from {', '.join(STATISTICS)})")
+        if ks[0] < 1:
+            self.arg_parser.error('--top-k and --top-ks need values of at least 1')
+        if len(statistics) * len(ks) > 1 and not self.options.output_prefix:
+            self.arg_parser.error('several statistics or K values need --output-prefix')
+        if self.options.partition_plan and self.options.internal_protocol == 'compact':
+            # the partitioner hashes the route digits at the start of the JSON key text
+            self.arg_parser.error('--partition-plan needs --internal-protocol json')
+        if self.options.engine == 'multiprocess' and (
+                not self.options.args
+                or any(p == '-' or not os.path.isfile(p) for p in self.options.args)):
+            # the engine maps the input files itself, stdin and HDFS paths need a runner
+            self.arg_parser.error('--engine multiprocess needs local input files')
+        if self.options.partition_plan and (self.options.approximate
+                                            or self.options.engine == 'multiprocess'):
+            self.stderr.write(b'--partition-plan only applies to the exact steps on mrjob runners\n')
+        self.sizing = self.size_steps()
+
+        # sketches are merged by reducers, the approximate steps always run on mrjob's runners
+        if self.options.approximate:
+            if self.options.engine == 'multiprocess':
+                self.stderr.write(b'--approximate counts on the mrjob runner, '
+                                  b'--engine multiprocess only applies to --exact-recount\n')
+            if (self.options.output_prefix or statistics != ['chi2']) and not self.options.exact_recount:
+                self.stderr.write(b'--approximate only ranks by chi2 and prints the output, '
+                                  b'--statistics and --output-prefix need --exact-recount\n')
+            if self.options.exact_recount:
+                self.run_exact_recount()
+            else:
+                super(ChiSquareCalculator, self).run_job()
+            return
+
+        # the native engine bypasses mrjob's runners when running on one machine
+        if self.options.engine == 'multiprocess':
+            from local_engine import run_multiprocess
+            # the engine merges additive stage-1 counts and has no launch overhead to save,
+            # so it always runs the four-step functions
+            self.options.layout = 'four-step'
+            snapshots = None
+            if self.options.snapshot_dir:
+                from count_snapshot import SnapshotStore
+                snapshots = SnapshotStore(self.options.snapshot_dir, self.stage1_settings(),
+                                          self.options.snapshot_keep)
+            cache, key = self.stage1_cache() if snapshots is None else (None, None)
+            run_multiprocess(self, self._cl_args + ['--layout', 'four-step'], self.options.workers,
+                             cache, key, snapshots)
+        else:
+            if self.options.cache_dir or self.options.snapshot_dir:
+                self.stderr.write(b'--cache-dir and --snapshot-dir only apply to --engine multiprocess\n')
+            if self.options.max_vocab and self.options.layout == 'two-step':
+                # the two-step layout never sees global term totals before the join
+                self.stderr.write(b'--max-vocab only applies to the four-step layout\n')
+            if self.options.layout == 'two-step' or self.options.output_prefix:
+                self.run_with_driver_output()
+            else:
+                super(ChiSquareCalculator, self).run_job()
+
+    def size_steps(self):
+        # reducer counts and split size derived from the input (see step_sizing.py), None for
+        # the former fixed values (the default on the local runners, which ignore them); the
+        # choices and their reasons go to stderr
+        self.sizing = None
+        # no -r runs inline
+        runner = self.options.runner or 'inline'
+        sizing = self.options.sizing or ('fixed' if runner in ('inline', 'local') else 'auto')
+        if sizing == 'fixed' or self.options.engine == 'multiprocess' or not self.options.args:
+            return None
+
+        from itertools import islice
+        from mrjob.util import to_lines
+        from partition_plan import sample_lines
+
+        paths = self.options.args
+        sample = self.options.sizing_sample
+        try:
+            if all(os.path.isfile(p) for p in paths):
+                input_bytes = sum(os.path.getsize(p) for p in paths)
+                lines = [line for p in paths for line in sample_lines(p, sample // len(paths) or 1)]
+            else:
+                # e.g. HDFS input, sampled from the head of its first file
+                with self.make_runner() as runner:
+                    input_bytes = sum(runner.fs.du(p) for p in paths)
+                    first = next(iter(runner.fs.ls(paths[0])))
+                    lines = list(islice(to_lines(runner.fs.cat(first)), sample))
+        except (IOError, OSError, StopIteration) as e:
+            self.stderr.write(f"sizing: input not readable ({e}), fixed values used\n".encode('utf-8'))
+            return None
+
+        # the stopword file may only exist on the cluster
+        stopwords = self.options.stopwords
+        stats = sample_statistics(lines, load_stopword_filter(
+            stopwords if stopwords and os.path.isfile(stopwords) else None))
+        split = int(self.options.split_mb * MB) if self.options.split_mb else None
+        sizes, reasons = size_steps(input_bytes, stats, self.options.task_slots,
+                                    self.options.max_reducers, split, self.options.reducers)
+        if self.options.partition_plan:
+            reasons.append('the routed steps use the reducers of --partition-plan')
+        if not self.options.quiet:
+            for reason in reasons:
+                self.stderr.write(f"sizing: {reason}\n".encode('utf-8'))
+        return sizes
+
+    def tune(self, stage):
+        # jobconf of the steps of a stage ('count', 'join' or 'score'), with its derived or
+        # fixed reducer count and split size, and --reducers and --split-mb applied
+        sizes = getattr(self, 'sizing', None) or FIXED
+        reducers = self.options.reducers or sizes['reducers'][stage]
+        split = int(self.options.split_mb * MB) if self.options.split_mb else sizes['split']
+        return {
+            'mapreduce.input.fileinputformat.split.maxsize': str(split),
+            'mapreduce.input.fileinputformat.split.minsize': str(min(sizes['min split'], split)),
+            'mapred.job.inputformat.class': 'org.apache.hadoop.mapred.lib.CombineTextInputFormat',
+            'mapreduce.job.reduces': str(reducers),
+            'mapreduce.map.output.compress': 'true',
+            'mapreduce.map.output.compress.codec': 'org.apache.hadoop.io.compress.SnappyCodec',
+            'mapreduce.output.fileoutputformat.compress': 'true',
+            'mapreduce.output.fileoutputformat.compress.codec': 'org.apache.hadoop.io.compress.SnappyCodec',
+            'mapreduce.job.jvm.numtasks': '-1',
+            'mapreduce.map.speculative': 'true',
+            'mapreduce.reduce.speculative': 'true',
+        }
+
+    def stage1_settings(self):
+        # fingerprint of the stopwords, ID dictionary and tokenizer behind the stage-1 counts
+        from count_cache import content_hash, settings_fingerprint
+        config = {'fields': FIELDS, 'tokenizer': TOKENIZER.config()}
+        if self.options.candidate_file:
+            config['candidates'] = content_hash(self.options.candidate_file)
+        return settings_fingerprint(self.options.stopwords, self.options.id_dictionary, config)
+
+    def stage1_cache(self):
+        # (CountCache, key of this run's inputs and settings), or (None, None) without --cache-dir
+        paths = self.options.args
+        if not self.options.cache_dir or not all(os.path.isfile(p) for p in paths):
+            return None, None
+        from count_cache import CountCache, cache_key
+        cache = CountCache(self.options.cache_dir, int(self.options.cache_max_mb * 2 ** 20))
+        return cache, cache_key(paths, self.stage1_settings())
+
+    def run_steps(self):
+        # (key, value) pairs of the last step, after running the steps on the chosen runner
+        log_stream = codecs.getwriter('utf_8')(self.stderr)
+        self.set_up_logging(quiet=self.options.quiet, verbose=self.options.verbose,
+                            stream=log_stream)
+        with self.make_runner() as runner:
+            try:
+                runner.run()
+            except StepFailedException as e:
+                log.error(str(e))
+                sys.exit(1)
+            return list(self.parse_output(runner.cat_output()))
+
+    def run_with_driver_output(self):
+        # running the steps on the chosen runner, then merging the category lists (two-step
+        # layout) and writing the output in the driver
+        self.write_output(self.run_steps())
+
+    def run_exact_recount(self):
+        # approximate run for the candidate terms, then the exact job restricted to them;
+        # only the exact job writes to the user's --output-dir, the candidates go to a
+        # temporary directory of the runner
+        output_dir, self.options.output_dir = self.options.output_dir, None
+        try:
+            terms = [value for _, value in self.run_steps()]
+        finally:
+            self.options.output_dir = output_dir
+        log.info('recounting %d candidate terms exactly', len(terms))
+
+        tmp_dir = tempfile.mkdtemp(prefix='chi-square-candidates-')
+        try:
+            path = os.path.join(tmp_dir, 'candidates.txt')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.writelines(t + '\n' for t in terms)
+            args = [a for a in self._cl_args if a not in ('--approximate', '--exact-recount')]
+            job = type(self)(args=args + ['--candidate-file', path])
+            # writing to this job's streams
+            job.sandbox(self.stdin, self.stdout, self.stderr)
+            job.execute()
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def write_output(self, pairs):
+        # final output from the (key, value) pairs of the last step, to stdout or one file
+        # per (statistic, K) key with --output-prefix
+        if self.options.layout == 'two-step':
+            pairs = self.reducer_merge(None, (value for _, value in pairs))
+        if not self.options.output_prefix:
+            for _, line in pairs:
+                self.stdout.write(line.encode('utf-8') + b'\n')
+            self.stdout.flush()
+            return
+
+        files = {}
+        for (statistic, k), line in pairs:
+            files.setdefault(f"{self.options.output_prefix}{statistic}_top{k}.txt", []).append(line)
+        for path, lines in files.items():
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.writelines(line + '\n' for line in lines)
 
     def mapper_init(self):
-        # loading stopwords
-        sw = set()
-        if self.options.stopwords:
-            with open(self.options.stopwords) as f:
-                for line in f:
-                    sw.add(line.strip())
-        self.stopwords = sw
-        self.translator = ChiSquareCalculator.TRANSLATOR
-
-        # initialize buffer for emitted key-value pairs
-        self.buf = {}
-        self.ev_count = 0  # event counter manages buffer flush threshold
+        # stopword filter, loaded once per process and reused by later tasks
+        self.stopword_filter = load_stopword_filter(self.options.stopwords)
+
+        # optional dictionary encoding, unknown categories and terms stay strings
+        self.cat_ids, self.term_ids = {}, {}
+        if self.options.id_dictionary:
+            self.cat_ids, self.term_ids = load_id_dictionary(self.options.id_dictionary)
+
+        # document-frequency histogram for --max-vocab, only built by the second step
+        self.df_histogram = None
+
+        # optional restriction to candidate terms, e.g. those of an approximate run
+        self.candidate_terms = None
+        if self.options.candidate_file:
+            with open(self.options.candidate_file, encoding='utf-8') as f:
+                self.candidate_terms = frozenset(line.strip() for line in f if line.strip())
+
+        # bounded in-mapper combiner, spilling its coldest keys in batches
+        max_mb = self.options.combine_max_mb
+        self.cache = AggregationCache(self.options.combine_max_entries or None,
+                                      int(max_mb * 2 ** 20) if max_mb else None)
+
+        # set by make_step with --profile
+        self.profiler = None
 
     def mapper(self, _, line):
-        #  reading in each JSON review line, skipping malformed ones
-        try:
-            doc = json.loads(line)
-        except:
+        # a sampled review is counted by mapper_timed instead
+        profiler = self.profiler
+        if profiler is not None and profiler.record(len(line)):
+            yield from self.mapper_timed(line)
+            return
+
+        # decoding only category, reviewText and summary of each review, skipping malformed ones
+        fields = decode_review(line)
+        if fields is None:
             return
 
         # extracting category and count doc for its category
-        cat = doc.get('category', '')
-        self.ev_count += 1
-        self.buf[('!DOC_COUNT', cat)] = self.buf.get(('!DOC_COUNT', cat), 0) + 1
-
-        # combinimg and preprocessing text
-        text = (doc.get('reviewText', '') + ' ' + doc.get('summary', '')).lower()
-        toks = text.translate(self.translator).split()
-
-        # filter tokens
-        seen = set()
-        for t in toks:
-            if len(t) > 1 and t not in self.stopwords and t not in seen:
-                seen.add(t)
-                self.ev_count += 2
-                # emitting category-specific token frequency
-                self.buf[(cat, t)] = self.buf.get((cat, t), 0) + 1
-                # emitting global token frequency
-                self.buf[('*', t)] = self.buf.get(('*', t), 0) + 1
-
-        # flush buffer when threshold is reached
-        if self.ev_count >= 200000:
-            for k, v in self.buf.items():
-                yield k, v
-            self.buf.clear()
-            self.ev_count = 0
+        cat, review_text, summary = fields
+        cat = self.cat_ids.get(cat, cat)
+
+        # combinimg and tokenizing text
+        toks = tokenize(review_text + ' ' + summary)
+
+        # unique tokens without stopwords and single characters
+        terms = self.stopword_filter.unique_terms(toks)
+        if self.candidate_terms is not None:
+            terms = self.candidate_terms.intersection(terms)
+        term_ids = self.term_ids
+        if term_ids:
+            terms = [term_ids.get(t, t) for t in terms]
+        # counting the doc for its category, and category-specific and global token frequency
+        cache = self.cache
+        cache.add_review(cat, terms)
+
+        # emitting the pairs the cache had to evict
+        if cache.spilled:
+            yield from cache.drain()
+
+    def mapper_timed(self, line):
+        # the phases of mapper for one review, each timed by the profiler
+        profiler = self.profiler
+        start = clock()
+        fields = decode_review(line)
+        decoded = clock()
+        profiler.add('decode', decoded - start)
+        if fields is None:
+            return
+
+        cat, review_text, summary = fields
+        toks = tokenize(review_text + ' ' + summary)
+        tokenized = clock()
+
+        terms = self.stopword_filter.unique_terms(toks)
+        if self.candidate_terms is not None:
+            terms = self.candidate_terms.intersection(terms)
+        filtered = clock()
+
+        cat = self.cat_ids.get(cat, cat)
+        term_ids = self.term_ids
+        if term_ids:
+            terms = [term_ids.get(t, t) for t in terms]
+        cache = self.cache
+        cache.add_review(cat, terms)
+        buffered = clock()
+
+        spilled = cache.drain() if cache.spilled else ()
+        profiler.add('tokenize', tokenized - decoded)
+        profiler.add('filter', filtered - tokenized)
+        profiler.add('buffer', buffered - filtered)
+        profiler.add('flush', clock() - buffered)
+        yield from spilled
 
     def mapper_final(self):
-        # emitting remaining buffered items
-        for k, v in self.buf.items():
-            yield k, v
+        # emitting remaining cached items and publishing the cache statistics
+        for name, value in self.cache.stats().items():
+            self.increment_counter('combiner cache', name, value)
+        yield from self.cache.flush()
 
     def combiner(self, key, counts):
         # summing values locally
         yield key, sum(counts)
 
     def reducer_sum(self, key, counts):
-        # final aggregation of all counts
-        yield key, sum(counts)
+        # final aggregation of all counts, term totals below --min-df are final and dropped
+        total = sum(counts)
+        if total < self.options.min_df and key[0] == '*':
+            self.count_dropped('after counting', [(key, total)])
+            return
+        yield key, total
+
+    def pruning_init(self):
+        # records dropped by --min-df and --max-vocab, published as counters by pruning_final
+        self.dropped = {}
+
+    def count_dropped(self, where, records, terms=1):
+        # counting the terms of dropped (key, value) records and their size in the internal protocol
+        write = self.internal_protocol().write
+        size = sum(len(write(k, v)) + 1 for k, v in records)
+        terms_dropped, bytes_dropped = self.dropped.get(where, (0, 0))
+        self.dropped[where] = (terms_dropped + terms, bytes_dropped + size)
+
+    def pruning_final(self):
+        # one counter update per task instead of one per dropped record
+        for where, (terms, size) in self.dropped.items():
+            self.increment_counter('pruning', f"terms dropped {where}", terms)
+            self.increment_counter('pruning', f"bytes dropped {where}", size)
+
+    def mapper_init_stage2(self):
+        self.df_histogram = {} if self.options.max_vocab else None
 
     def mapper_stage2(self, key, count):
-        # rearranging keys to group data for chi-square input
+        # re-keying counts by term so that each term total meets its per-category counts
         kind, val = key
         if kind == '!DOC_COUNT':
-            yield ('__DOC_COUNT__', val), count
+            yield '!DOC_COUNT', (val, count)
         elif kind == '*':
-            yield ('__TERM_TOTAL__', val), count
+            if self.df_histogram is not None and count >= self.options.min_df:
+                self.df_histogram[count] = self.df_histogram.get(count, 0) + 1
+            yield val, ('*', count)
         else:
-            yield (val, kind), count
+            yield val, (kind, count)
 
-    def combiner_stage2(self, key, counts):
-        # local sums
-        yield key, sum(counts)
+    def mapper_final_stage2(self):
+        # number of terms per document frequency, joining the doc counts for --max-vocab
+        for df, n in (self.df_histogram or {}).items():
+            yield '!DOC_COUNT', ('!DF', df, n)
+
+    def reducer_stage2(self, key, values):
+        if key == '!DOC_COUNT':
+            # broadcasting the (small) doc counts per category to every category reducer,
+            # as pairs since JSON objects would turn integer category IDs into strings,
+            # with the smallest term total kept by --max-vocab
+            doc_counts = []
+            histogram = {}
+            for value in values:
+                if value[0] == '!DF':
+                    histogram[value[1]] = histogram.get(value[1], 0) + value[2]
+                else:
+                    doc_counts.append(tuple(value))
+            min_total = vocabulary_threshold(histogram, self.options.max_vocab)
+            for cat, _ in doc_counts:
+                yield cat, ('!DOC_COUNT', doc_counts, min_total)
+            return
+
+        # joining the term total onto every category count of this term
+        total = 0
+        per_cat = []
+        for kind, cnt in values:
+            if kind == '*':
+                total = cnt
+            else:
+                per_cat.append((kind, cnt))
+        if total < self.options.min_df:
+            # a rare term, or one whose total was already dropped by reducer_sum
+            self.count_dropped('at the join', [(cat, (key, A, total)) for cat, A in per_cat])
+            return
+        for cat, A in per_cat:
+            yield cat, (key, A, total)
+
+    def mapper_joined(self, key, line):
+        # two-step layout: emitting the counts directly keyed by term (see mapper_stage2)
+        for k, v in self.mapper(key, line):
+            yield from self.mapper_stage2(k, v)
+
+    def mapper_final_joined(self):
+        for k, v in self.mapper_final():
+            yield from self.mapper_stage2(k, v)
 
-    def reducer_stage2(self, key, counts):
-        # collecting all values under a common key for final reducer
-        yield '__GLOBAL__', (key, sum(counts))
+    def combiner_joined(self, key, values):
+        # summing the counts of each category (or '*') of this term locally
+        sums = {}
+        for kind, cnt in values:
+            sums[kind] = sums.get(kind, 0) + cnt
+        for kind, cnt in sums.items():
+            yield key, (kind, cnt)
+
+    def reducer_joined(self, key, values):
+        # final sums per category, then the same join as reducer_stage2
+        summed = (value for _, value in self.combiner_joined(key, values))
+        yield from self.reducer_stage2(key, summed)
 
     def reducer_final_init(self):
-        # initializing dictionaries
-        self.doc_counts = {}
-        self.term_totals = {}
-        self.observations = []
-
-    def reducer_final(self, _, items):
-        # parsing grouped input and build in-memory datasets
-        for (kind, ident), cnt in items:
-            if kind == '__DOC_COUNT__':
-                self.doc_counts[ident] = cnt
-            elif kind == '__TERM_TOTAL__':
-                self.term_totals[ident] = cnt
+        self.pruning_init()
+        # reverse dictionary to decode integer IDs back to strings
+        self.cat_names, self.term_names = {}, {}
+        if self.options.id_dictionary:
+            cat_ids, term_ids = load_id_dictionary(self.options.id_dictionary)
+            self.cat_names = {i: c for c, i in cat_ids.items()}
+            self.term_names = {i: t for t, i in term_ids.items()}
+
+    def reducer_final(self, cat, values):
+        # scoring the (term, A, term total) rows in vectorized blocks while keeping only the best
+        # k, for every statistic in one pass over the rows
+        statistics, ks = self.rankings()
+        tops = None
+        pending = []
+        dropped = []
+        min_total = 0
+        term_names = self.term_names
+        for value in values:
+            if value[0] == '!DOC_COUNT':
+                # total number of documents and documents in this category
+                doc_counts = dict(value[1])
+                min_total = value[2]
+                N, C = sum(doc_counts.values()), doc_counts.get(cat, 0)
+                tops = [TopK(ks[-1], N, C, statistic=name) for name in statistics]
+                for row in pending:
+                    if row[2] >= min_total:
+                        for top in tops:
+                            top.add(*row)
+                    else:
+                        dropped.append(row)
+                pending = []
             else:
-                self.observations.append((kind, ident, cnt))
-
-        # total number of documents
-        N = sum(self.doc_counts.values())
-        buckets = {} # for categories
-
-        # compute chi-square per (token, category)
-        for term, cat, A in self.observations:
-            T = self.term_totals.get(term, 0)
-            C = self.doc_counts.get(cat, 0)
-            B = T - A
-            D = N - C - B - A
-            denom = (A+B)*(C+D)*(A+C)*(B+D)
-            if denom == 0:
-                continue
-            chi2 = N * (A*D - B*C)**2 / denom
-            buckets.setdefault(cat, []).append((term, chi2))
+                # decoding term IDs before ranking so ties still break by term text
+                term, A, T = value
+                row = (term_names.get(term, term), A, T)
+                if tops is None:
+                    # doc counts sort first, rows are only held back if they did not
+                    pending.append(row)
+                elif T >= min_total:
+                    for top in tops:
+                        top.add(*row)
+                else:
+                    # outside the --max-vocab most frequent terms
+                    dropped.append(row)
+        if dropped:
+            # terms counted once per category
+            self.count_dropped('before scoring', [(cat, row) for row in dropped], len(dropped))
+        if tops is None:
+            return
+        cat = self.cat_names.get(cat, cat)
+        # top terms per statistic in descending order, ties broken by tie_key to stay
+        # deterministic, so the top k of every smaller k is a prefix
+        rankings = [top.result() for top in tops]
+        if not any(rankings):
+            return
+        yield None, (cat, rankings)
+
+    def reducer_merge(self, _, cat_tops):
+        # emitting top k per category in alphabetic order and merge vocabulary, for every
+        # statistic and k (keyed by them with --output-prefix)
+        statistics, ks = self.rankings()
+        cat_tops = sorted(cat_tops)
+        if not cat_tops:
+            # empty input: no category lines and no merged line, like the four-step layout
+            return
+        for i, name in enumerate(statistics):
+            fmt = STATISTICS[name][2]
+            for k in ks:
+                key = (name, k) if self.options.output_prefix else None
+                merged_terms = set()
+                for cat, rankings in cat_tops:
+                    best = rankings[i][:k]
+                    if not best:
+                        continue
+                    merged_terms.update(t for t, _ in best)
+                    yield key, cat + ' ' + ' '.join(f"{t}:{v:{fmt}}" for t, v in best)
+                # emitting merged dictionary
+                yield key, ' '.join(sorted(merged_terms))
+
+    def mapper_init_sketch(self):
+        # per-category doc counts, Count-Min sketches and heavy hitters of this mapper
+        from sketches import CountMinSketch, HeavyHitters
+        self.stopword_filter = load_stopword_filter(self.options.stopwords)
+        width, depth = self.options.sketch_width, self.options.sketch_depth
+        self.doc_counts = {}
+        self.sketches = {}
+        self.heavy_hitters = {}
+        self.new_sketch = lambda: CountMinSketch(width, depth)
+        self.new_heavy_hitters = lambda: HeavyHitters(self.options.candidates)
+
+    def mapper_sketch(self, _, line):
+        # counting a review into the sketch and heavy hitters of its category, emitting nothing
+        fields = decode_review(line)
+        if fields is None:
+            return ()
+        cat, review_text, summary = fields
+        terms = self.stopword_filter.unique_terms(tokenize(review_text + ' ' + summary))
+        self.doc_counts[cat] = self.doc_counts.get(cat, 0) + 1
+        sketch = self.sketches.get(cat)
+        if sketch is None:
+            sketch = self.sketches[cat] = self.new_sketch()
+            self.heavy_hitters[cat] = self.new_heavy_hitters()
+        sketch.add(terms)
+        self.heavy_hitters[cat].add(terms)
+        return ()
+
+    def mapper_final_sketch(self):
+        # one record per category: doc count, serialized sketch and heavy-hitter counts
+        for cat, sketch in self.sketches.items():
+            data = sketch.dumps()
+            self.increment_counter('approximate', 'sketch bytes', len(data))
+            yield cat, (self.doc_counts[cat], data, self.heavy_hitters[cat].items())
+
+    def reducer_sketch(self, cat, values):
+        # merging the mapper sketches and heavy hitters of one category
+        from sketches import CountMinSketch, HeavyHitters
+        docs = 0
+        sketch = heavy = None
+        for n, data, counts in values:
+            docs += n
+            part = CountMinSketch.loads(data)
+            sketch = part if sketch is None else sketch.merge(part)
+            part = HeavyHitters(self.options.candidates, counts)
+            heavy = part if heavy is None else heavy.merge(part)
+        yield None, (cat, docs, sketch.dumps(), heavy.terms())
+
+    def reducer_approximate(self, _, values):
+        # chi-square of the candidate terms from sketch estimates, term totals from the sum of all sketches
+        from sketches import CountMinSketch
+        cats = []
+        total = None
+        candidates = set()
+        for cat, docs, data, terms in sorted(values):
+            sketch = CountMinSketch.loads(data)
+            cats.append((cat, docs, sketch))
+            if total is None:
+                total = CountMinSketch(sketch.width, sketch.depth)
+            total.merge(sketch)
+            candidates.update(terms)
+        candidates = sorted(candidates)
+        self.increment_counter('approximate', 'candidate terms', len(candidates))
+
+        if self.options.exact_recount:
+            # the driver recounts these exactly (see run_exact_recount)
+            for term in candidates:
+                yield None, term
+            return
+
+        # overestimate of a category count exceeded with probability exp(-depth)
+        bound = max(sketch.error_bound() for _, _, sketch in cats)
+        self.increment_counter('approximate', 'count error bound', int(bound))
 
-        # collecting top 75 terms per category and merge vocabulary
+        N = sum(docs for _, docs, _ in cats)
+        T = total.estimate(candidates).tolist()
         merged_terms = set()
-        for cat in sorted(buckets):
-            top = sorted(buckets[cat], key=lambda x: -x[1])[:75]
-            merged_terms.update(t for t, _ in top)
-            # emitting top 75 per category
-            yield None, cat + ' ' + ' '.join(f"{t}:{v:.3f}" for t, v in top)
-        # emitting merged dictionary
-        merged = sorted(merged_terms)
-        yield None, ' '.join(merged)
+        for cat, docs, sketch in cats:
+            top = TopK(self.options.top_k, N, docs)
+            for term, A, t in zip(candidates, sketch.estimate(candidates).tolist(), T):
+                if A:
+                    top.add(term, A, t)
+            best = top.result()
+            if not best:
+                continue
+            merged_terms.update(t for t, _ in best)
+            yield None, cat + ' ' + ' '.join(f"{t}:{v:.3f}" for t, v in best)
+        yield None, ' '.join(sorted(merged_terms))
+
+    def make_step(self, number, shuffle=None, output=None, **funcs):
+        # MRStep, with --profile its mapper and reducer run under a StageProfiler, with
+        # --partition-plan its shuffle is routed by the plan's `shuffle` units ('terms' or
+        # 'categories') and its output by the `output` units, for a next step without mapper
+        if self.options.profile:
+            for kind in ('mapper', 'reducer'):
+                if funcs.get(kind):
+                    funcs.update(self.profiled(f"step {number} {kind}", kind, funcs,
+                                               raw_input=number == 1))
+        plan = self.partition_plan()
+        if plan is not None and shuffle:
+            funcs.update(self.routed(number, plan, shuffle, output, funcs))
+        return MRStep(**funcs)
+
+    def partition_plan(self):
+        # the --partition-plan of the exact steps on mrjob runners, loaded once, in IDs with
+        # --id-dictionary
+        if not self.options.partition_plan or self.options.engine != 'mrjob':
+            return None
+        plan = getattr(self, '_partition_plan', None)
+        if plan is None:
+            plan = PartitionPlan.load(self.options.partition_plan)
+            if self.options.id_dictionary:
+                plan = plan.with_ids(*load_id_dictionary(self.options.id_dictionary))
+            self._partition_plan = plan
+        return plan
+
+    def routed(self, number, plan, shuffle, output, funcs):
+        # step functions keying the shuffle as [route, key], the reducer stripping the route and
+        # counting its keys and records per planned reducer, plus the partitioner settings
+        def unit(key):
+            # the term of a stage-1 (kind, term) key, the key itself otherwise
+            return key[1] if isinstance(key, (list, tuple)) else key
+
+        def with_routes(kind, pairs):
+            for key, value in pairs:
+                yield [plan.route(kind, unit(key)), key], value
+
+        mapper, mapper_final = funcs.get('mapper'), funcs.get('mapper_final')
+        reducer, reducer_init = funcs['reducer'], funcs.get('reducer_init')
+        reducer_final = funcs.get('reducer_final')
+        # [keys, records] per planned reducer
+        loads = {}
+
+        def counted(load, values):
+            for value in values:
+                load[1] += 1
+                yield value
+
+        def routed_reducer(key, values):
+            route, key = key
+            load = loads.setdefault(plan.reducer_of_route(route), [0, 0])
+            load[0] += 1
+            pairs = reducer(key, counted(load, values))
+            return with_routes(output, pairs) if output else pairs
+
+        def routed_reducer_init():
+            loads.clear()
+            return reducer_init() if reducer_init else None
+
+        def routed_reducer_final():
+            pairs = (reducer_final() if reducer_final else None) or ()
+            yield from with_routes(output, pairs) if output else pairs
+            for r, (keys, records) in sorted(loads.items()):
+                self.increment_counter('partition plan', f"step {number} reducer {r} keys", keys)
+                self.increment_counter('partition plan', f"step {number} reducer {r} records", records)
+
+        funcs = {'reducer': routed_reducer, 'reducer_init': routed_reducer_init,
+                 'reducer_final': routed_reducer_final,
+                 'jobconf': dict(funcs.get('jobconf') or {}, **{
+                     'mapreduce.partition.keypartitioner.options': plan.partitioner_options(),
+                     'mapreduce.job.reduces': str(plan.reducers)})}
+        if mapper:
+            funcs['mapper'] = lambda key, value: with_routes(shuffle, mapper(key, value))
+            funcs['mapper_final'] = lambda: with_routes(
+                shuffle, (mapper_final() if mapper_final else None) or ())
+        return funcs
+
+    def profiled(self, task, kind, funcs, raw_input=False):
+        # init, main and final functions of a mapper or reducer counting and timing its records
+        # (raw review lines for the first mapper), the counts and times are published as
+        # counters (and the trace) by the final function
+        init, main, final = funcs.get(kind + '_init'), funcs[kind], funcs.get(kind + '_final')
+        # the first step's mappers count and time their own records, phase by phase
+        phased = main in (self.mapper, self.mapper_joined)
+        write = self.internal_protocol().write
+        phase = 'map' if kind == 'mapper' else 'reduce'
+        profiler = None
+
+        def profiled_init():
+            nonlocal profiler
+            result = init() if init else None
+            profiler = StageProfiler(task, self.options.profile_sample, write)
+            if kind == 'mapper':
+                self.profiler = profiler
+            return result
+
+        def profiled_main(key, value):
+            if phased:
+                return profiler.output(main(key, value))
+            if kind == 'reducer':
+                # values are an iterator, only keys are counted
+                sampled = profiler.record()
+            elif raw_input:
+                sampled = profiler.record(len(value))
+            else:
+                sampled = profiler.record(pair=(key, value))
+            if sampled:
+                return profiler.output(profiler.timed(phase, main(key, value)))
+            return profiler.output(main(key, value))
+
+        def profiled_final():
+            pairs = (final() if final else None) or ()
+            yield from profiler.output(profiler.timed('flush' if phased else 'final', pairs,
+                                                      sampled=False))
+            for name, value in profiler.counters():
+                self.increment_counter('profile', name, value)
+            if self.options.profile_trace:
+                profiler.append_trace(self.options.profile_trace)
+
+        return {kind + '_init': profiled_init, kind: profiled_main, kind + '_final': profiled_final}
 
     def steps(self):
-        tune = {
-            'mapreduce.input.fileinputformat.split.maxsize': '134217728',
-            'mapreduce.input.fileinputformat.split.minsize': '1048576',
-            'mapred.job.inputformat.class': 'org.apache.hadoop.mapred.lib.CombineTextInputFormat',
-            'mapreduce.job.reduces': '5',
-            'mapreduce.map.output.compress': 'true',
-            'mapreduce.map.output.compress.codec': 'org.apache.hadoop.io.compress.SnappyCodec',
-            'mapreduce.output.fileoutputformat.compress': 'true',
-            'mapreduce.output.fileoutputformat.compress.codec': 'org.apache.hadoop.io.compress.SnappyCodec',
-            'mapreduce.job.jvm.numtasks': '-1',
-            'mapreduce.map.speculative': 'true',
-            'mapreduce.reduce.speculative': 'true',
-        }
+        if self.options.approximate:
+            return [
+                # Stage 1: per-category sketches and heavy hitters, merged per category
+                self.make_step(1,
+                    mapper_init=self.mapper_init_sketch,
+                    mapper=self.mapper_sketch,
+                    mapper_final=self.mapper_final_sketch,
+                    reducer=self.reducer_sketch,
+                    jobconf=self.tune('score')
+                ),
+                # Stage 2: chi-square of the candidates in a single reducer
+                self.make_step(2,
+                    reducer=self.reducer_approximate
+                ),
+            ]
+
+        if self.options.layout == 'two-step':
+            return [
+                # Stage 1: counting, keyed by term so term totals are joined in the same reducer
+                self.make_step(1, shuffle='terms', output='categories',
+                    mapper_init=self.mapper_init,
+                    mapper=self.mapper_joined,
+                    mapper_final=self.mapper_final_joined,
+                    combiner=self.combiner_joined,
+                    reducer_init=self.pruning_init,
+                    reducer=self.reducer_joined,
+                    reducer_final=self.pruning_final,
+                    jobconf=self.tune('count')
+                ),
+                # Stage 2: chi-square and top k per category, merged by the driver
+                self.make_step(2, shuffle='categories',
+                    reducer_init=self.reducer_final_init,
+                    reducer=self.reducer_final,
+                    reducer_final=self.pruning_final,
+                    jobconf=self.tune('score')
+                ),
+            ]
 
         return [
             # Stage 1: document + token counting
-            MRStep(
+            self.make_step(1, shuffle='terms',
                 mapper_init=self.mapper_init,
                 mapper=self.mapper,
                 mapper_final=self.mapper_final,
                 combiner=self.combiner,
+                reducer_init=self.pruning_init,
                 reducer=self.reducer_sum,
-                jobconf=tune
+                reducer_final=self.pruning_final,
+                jobconf=self.tune('count')
             ),
-            # Stage 2: key reorganization for chi-square
-            MRStep(
+            # Stage 2: joining term totals onto category counts, broadcasting doc counts,
+            # dropping terms below --min-df
+            self.make_step(2, shuffle='terms', output='categories',
+                mapper_init=self.mapper_init_stage2,
                 mapper=self.mapper_stage2,
-                combiner=self.combiner_stage2,
+                mapper_final=self.mapper_final_stage2,
+                reducer_init=self.pruning_init,
                 reducer=self.reducer_stage2,
-                jobconf=tune
+                reducer_final=self.pruning_final,
+                jobconf=self.tune('join')
             ),
-            # Stage 3: final chi-square computation and term selection
-            MRStep(
+            # Stage 3: chi-square computation and top k selection per category in parallel,
+            # skipping terms outside --max-vocab
+            self.make_step(3, shuffle='categories',
                 reducer_init=self.reducer_final_init,
-                reducer=self.reducer_final
+                reducer=self.reducer_final,
+                reducer_final=self.pruning_final,
+                jobconf=self.tune('score')
+            ),
+            # Stage 4: merging the per-category lists into the final output
+            self.make_step(4,
+                reducer=self.reducer_merge
             ),
         ]
 
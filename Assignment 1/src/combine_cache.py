@@ -0,0 +1,120 @@
+"""
+Memory-bounded aggregation cache for in-mapper combining.
+
+The mapper used to sum its (key, count) pairs in a plain dict and flush the whole dict
+after a fixed number of events, which threw away the hot keys (frequent terms, doc
+counts) together with the long tail every time. This cache is bounded by the number of
+distinct keys and/or an estimate of their memory, but it is still a plain dict updated
+inline, and the limit is only checked once per review. When it is crossed, the coldest
+keys (lowest counts, oldest first among equal counts) are spilled in one batch until the
+cache is down to half of the limit, so frequent keys keep aggregating for the whole task
+and the cost of a spill is spread over many new keys. Spilled pairs are partial counts;
+the combiner and reducer sum them as before.
+
+The memory limit is turned into a number of keys with the estimated size of the cached
+entries, re-measured on a sample of the keys at every spill.
+
+Hits (updates of a cached key), misses (new keys) and evictions are kept as plain ints
+and published once per task, e.g. as mrjob counters.
+"""
+from collections import Counter
+from itertools import islice
+
+# rough bytes per cached entry: dict slot, key tuple, int count
+ENTRY_OVERHEAD = 160
+# keys measured for the average entry size
+SIZE_SAMPLE = 1000
+
+
+def estimate_size(key):
+    # estimated bytes of one cached entry, string parts of the key counted by length
+    return ENTRY_OVERHEAD + sum(len(part) for part in key if isinstance(part, str))
+
+
+class AggregationCache(object):
+    """
+    Summing cache of (key, count) pairs holding at most max_entries keys and about
+    max_bytes of memory, evicting the coldest keys into `spilled` in batches.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.counts = {}
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self.spilled = []
+        # until the first spill, entries are assumed to hold 16 bytes of key text
+        self.limit = self._limit(ENTRY_OVERHEAD + 16)
+
+    def _limit(self, entry_bytes):
+        # number of keys allowed by both limits, None without limits
+        by_bytes = self.max_bytes and int(self.max_bytes // entry_bytes)
+        limits = [n for n in (self.max_entries, by_bytes) if n]
+        return max(min(limits), 1) if limits else None
+
+    def add_review(self, cat, terms):
+        # counting one review: its category doc count and a (cat, term) and ('*', term)
+        # key per unique term
+        counts = self.counts
+        get = counts.get
+        size = len(counts)
+        key = ('!DOC_COUNT', cat)
+        counts[key] = get(key, 0) + 1
+        for t in terms:
+            key = (cat, t)
+            counts[key] = get(key, 0) + 1
+            key = ('*', t)
+            counts[key] = get(key, 0) + 1
+        new = len(counts) - size
+        self.misses += new
+        self.hits += 1 + 2 * len(terms) - new
+        if self.limit and len(counts) > self.limit:
+            self._evict()
+
+    def _evict(self):
+        # spilling the coldest keys until the cache holds half of its limit
+        counts = self.counts
+        if self.max_bytes:
+            sample = list(islice(counts, 0, None, max(1, len(counts) // SIZE_SAMPLE)))
+            self.limit = self._limit(sum(map(estimate_size, sample)) / len(sample))
+        excess = len(counts) - self.limit // 2
+        if excess <= 0:
+            return
+
+        # smallest count that frees enough keys, together with all lower counts
+        histogram = Counter(counts.values())
+        below = 0
+        for cutoff in sorted(histogram):
+            if below + histogram[cutoff] >= excess:
+                break
+            below += histogram[cutoff]
+        at_cutoff = excess - below
+
+        kept = {}
+        spilled = self.spilled
+        for key, count in counts.items():
+            if count < cutoff:
+                spilled.append((key, count))
+            elif count == cutoff and at_cutoff:
+                # dict order is insertion order, the oldest keys at the cutoff go first
+                spilled.append((key, count))
+                at_cutoff -= 1
+            else:
+                kept[key] = count
+        self.counts = kept
+        self.evictions += excess
+
+    def drain(self):
+        # pairs evicted since the last call
+        spilled, self.spilled = self.spilled, []
+        return spilled
+
+    def flush(self):
+        # all remaining pairs, leaving the cache empty
+        pairs = self.drain()
+        pairs.extend(self.counts.items())
+        self.counts = {}
+        return pairs
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
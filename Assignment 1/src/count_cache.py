@@ -0,0 +1,119 @@
+"""
+Content-addressed cache of the stage-1 document-frequency table.
+
+The first step (decoding, tokenizing and counting every review) dominates a run, while
+its result, the ('!DOC_COUNT', cat) / (cat, term) / ('*', term) counts, only depends on
+the input, the stopwords, the ID dictionary and the tokenizer. Those are fingerprinted
+into a key: input files by size, modification time and hashes of evenly spaced sample
+blocks (hashing the whole corpus would cost a pass of its own), the small stopword and
+dictionary files by their full content. A run whose key is cached skips stage 1 and
+only recomputes chi-square and the top-K lists.
+
+Entries are pickled tables in one directory. Hits refresh an entry's modification time,
+and after every store the least recently used entries are removed until the directory
+fits into the size limit.
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+# bumped whenever the stored table or the way it is computed changes
+FORMAT_VERSION = 1
+# sampled blocks per input file
+SAMPLES = 16
+SAMPLE_SIZE = 1 << 16
+DEFAULT_MAX_BYTES = 1 << 30
+_SUFFIX = '.counts'
+
+
+def file_fingerprint(path, samples=SAMPLES, sample_size=SAMPLE_SIZE):
+    # size, mtime and hash of evenly spaced blocks, the whole file if it is small
+    st = os.stat(path)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        if st.st_size <= samples * sample_size:
+            digest.update(f.read())
+        else:
+            step = (st.st_size - sample_size) // (samples - 1)
+            for i in range(samples):
+                f.seek(i * step)
+                digest.update(f.read(sample_size))
+    return [st.st_size, st.st_mtime_ns, digest.hexdigest()]
+
+
+def content_hash(path):
+    # full hash of a small side file such as the stopwords, None if there is none
+    if not path:
+        return None
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def settings_fingerprint(stopwords=None, id_dictionary=None, config=None):
+    # everything besides the input the stage-1 table depends on
+    return {
+        'version': FORMAT_VERSION,
+        'stopwords': content_hash(stopwords),
+        'id_dictionary': content_hash(id_dictionary),
+        'config': config,
+    }
+
+
+def cache_key(inputs, settings):
+    # hex key of the inputs and the settings_fingerprint of a stage-1 table
+    parts = dict(settings, inputs=[file_fingerprint(p) for p in inputs])
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class CountCache(object):
+    """
+    Directory of stage-1 count tables by key, bounded to about max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def get(self, key):
+        # cached {key: count} table, or None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                counts = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(path)
+        return counts
+
+    def put(self, key, counts):
+        # writing atomically so concurrent runs never read a partial table
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(dict(counts), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        # removing least recently used entries until the directory fits max_bytes
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(_SUFFIX):
+                st = os.stat(os.path.join(self.directory, name))
+                entries.append((st.st_mtime_ns, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        # the newest entry stays even if it alone exceeds the limit
+        for _, size, name in sorted(entries)[:-1]:
+            if total <= self.max_bytes:
+                break
+            os.unlink(os.path.join(self.directory, name))
+            total -= size
@@ -0,0 +1,98 @@
+"""
+Versioned snapshots of the stage-1 count tables for incremental runs.
+
+The ('!DOC_COUNT', cat), (cat, term) and ('*', term) counts are additive over input
+files, so a growing review feed does not have to be recounted: a snapshot holds the
+merged counts of every file ingested so far, and an update only counts the files that
+are not in it yet and adds their counts. Chi-square and the top-K lists are then
+recomputed from the merged table, so the cost of a daily update scales with the new
+data rather than the whole history.
+
+Every update writes a new version (counts-000001.snapshot, counts-000002.snapshot, ...)
+next to the previous ones and keeps the newest few, so a bad ingest can be undone by
+deleting the latest file. Files are recognised by absolute path; a file that changed
+after it was ingested cannot be subtracted again and is rejected. A snapshot also
+records the settings fingerprint (stopwords, ID dictionary, tokenizer) of its counts
+and refuses to merge counts made with other settings.
+"""
+import os
+import pickle
+import re
+import tempfile
+
+from count_cache import file_fingerprint
+
+_NAME = re.compile(r'^counts-(\d{6})\.snapshot$')
+
+
+class SnapshotStore(object):
+    """
+    Directory of snapshot versions, each {'settings', 'files', 'counts'}, keeping the newest `keep`.
+    """
+
+    def __init__(self, directory, settings, keep=3):
+        self.directory = directory
+        self.settings = settings
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+
+    def versions(self):
+        # snapshot versions on disk, oldest first
+        found = (_NAME.match(name) for name in os.listdir(self.directory))
+        return sorted(int(m.group(1)) for m in found if m)
+
+    def _path(self, version):
+        return os.path.join(self.directory, f"counts-{version:06d}.snapshot")
+
+    def latest(self):
+        # (version, state) of the newest snapshot, (0, empty state) if there is none
+        versions = self.versions()
+        if not versions:
+            return 0, {'settings': self.settings, 'files': {}, 'counts': {}}
+        with open(self._path(versions[-1]), 'rb') as f:
+            return versions[-1], pickle.load(f)
+
+    def save(self, version, state):
+        # writing a new version atomically and removing all but the newest `keep`
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(version))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        for old in self.versions()[:-self.keep]:
+            os.unlink(self._path(old))
+
+    def update(self, paths, count):
+        """
+        Merges count(new_paths), a {key: count} table of the paths not ingested yet, into
+        the newest snapshot and returns (merged counts, version, new paths).
+        """
+        version, state = self.latest()
+        if state['settings'] != self.settings:
+            raise ValueError(f"snapshot version {version} in {self.directory} was counted with "
+                             "other stopwords, ID dictionary or tokenizer")
+
+        files = state['files']
+        new_paths, fingerprints = [], {}
+        for path in paths:
+            key = os.path.abspath(path)
+            size, _, digest = file_fingerprint(path)
+            if key in files:
+                if files[key] != [size, digest]:
+                    raise ValueError(f"{path} changed after it was ingested into snapshot "
+                                     f"version {version}, its old counts cannot be removed")
+            elif key not in fingerprints:
+                new_paths.append(path)
+                fingerprints[key] = [size, digest]
+        if not new_paths:
+            return state['counts'], version, []
+
+        counts = state['counts']
+        for k, v in count(new_paths).items():
+            counts[k] = counts.get(k, 0) + v
+        files.update(fingerprints)
+        self.save(version + 1, {'settings': self.settings, 'files': files, 'counts': counts})
+        return counts, version + 1, new_paths
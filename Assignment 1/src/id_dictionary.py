@@ -0,0 +1,73 @@
+"""
+Integer ID dictionary for categories and terms in the ChiSquareCalculator shuffle.
+
+Mappers of independent tasks can only agree on compact IDs if they share a dictionary,
+so the dictionary is built up front from a sample of the input: every category seen and
+the most frequent terms by document frequency, most frequent first so that the bulk of
+the shuffle gets the shortest IDs. Categories and terms missing from the dictionary
+simply stay strings, so a stale or small sample only lowers the hit rate and never
+changes the output. IDs are decoded back to strings in reducer_final.
+
+Build a dictionary from the first 100000 reviews:
+
+    python id_dictionary.py --stopwords ../Assignment_1_Assets/stopwords.txt reviews_devset.json > ids.txt
+"""
+import argparse
+import sys
+from collections import Counter
+from itertools import islice
+
+from review_decoder import decode_review
+from stopword_filter import load_stopword_filter
+from tokenizer import tokenize
+
+
+def load_id_dictionary(path):
+    # (category -> id, term -> id) from a dictionary file of 'c'/'t' tagged lines
+    cat_ids, term_ids = {}, {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            kind, _, name = line.rstrip('\n').partition('\t')
+            ids = cat_ids if kind == 'c' else term_ids
+            ids[name] = len(ids)
+    return cat_ids, term_ids
+
+
+def build_id_dictionary(lines, stopword_filter, max_terms=65536):
+    # (categories, terms) ordered by descending document frequency in the sampled lines
+    cats, terms = Counter(), Counter()
+    for line in lines:
+        fields = decode_review(line)
+        if fields is None:
+            continue
+        cat, review_text, summary = fields
+        cats[cat] += 1
+        toks = tokenize(review_text + ' ' + summary)
+        terms.update(stopword_filter.unique_terms(toks))
+    # a category containing a line break cannot be stored, it stays a string
+    return ([c for c, _ in cats.most_common() if '\n' not in c],
+            [t for t, _ in terms.most_common(max_terms)])
+
+
+def main():
+    from review_reader import read_range
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='review JSON-lines file to sample')
+    parser.add_argument('--stopwords', help='stopword file used by the job')
+    parser.add_argument('--sample', type=int, default=100000, help='number of reviews to sample')
+    parser.add_argument('--max-terms', type=int, default=65536, help='number of terms given an ID')
+    args = parser.parse_args()
+
+    cats, terms = build_id_dictionary(islice(read_range(args.input), args.sample),
+                                      load_stopword_filter(args.stopwords), args.max_terms)
+    out = open(sys.stdout.fileno(), 'w', encoding='utf-8', closefd=False)
+    for cat in cats:
+        out.write(f"c\t{cat}\n")
+    for term in terms:
+        out.write(f"t\t{term}\n")
+    out.flush()
+
+
+if __name__ == '__main__':
+    main()
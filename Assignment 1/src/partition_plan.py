@@ -0,0 +1,207 @@
+"""
+Skew-aware reducer assignment for the shuffle keys of ChiSquareCalculator.
+
+Hadoop streaming cannot run a Python partitioner, so the plan is applied by routing:
+the job wraps every shuffle key as [route, key], and the steps partition with the
+KeyFieldBasedPartitioner on the first characters of the key text only (`-k1.1,1.L`,
+the opening bracket and a fixed number of digits). For every reducer the plan holds a
+route number whose prefix hashes to it under the partitioner's hash (31 * h + byte,
+then (h & MAX_INT) % reducers), so a key goes to the reducer the plan picked. The
+reducers strip the route again.
+
+The plan is built from a sample of the input spread over the whole file (the review
+files are ordered by category, a head sample would miss most categories):
+
+- 'terms' for the counting and join steps, the key groups of one term (its
+  per-category keys and its total): terms with the most category keys in the sample are
+  packed onto the least loaded reducer, largest first, on top of the load the remaining
+  terms put on every reducer by hash
+- 'categories' for the chi-square step, keyed by category: the load of a category is its
+  number of distinct terms (one row each), every category is packed
+
+Units the plan does not know go to a reducer by CRC-32 of their text. The expected
+load per reducer and its imbalance (largest / mean load) are computed for the plan and
+for plain hash partitioning of the same keys.
+
+    python partition_plan.py --stopwords ../Assignment_1_Assets/stopwords.txt --reducers 5 reviews_devset.json > plan.json
+"""
+import argparse
+import json
+import sys
+import zlib
+from collections import defaultdict
+
+from review_decoder import decode_review
+from stopword_filter import load_stopword_filter
+from tokenizer import tokenize
+
+_MAX_INT = 0x7fffffff
+
+
+def key_field_hash(data, reducers):
+    # partition of KeyFieldBasedPartitioner for the hashed bytes of a key (Java bytes are signed)
+    h = 0
+    for b in data:
+        h = (31 * h + (b - 256 if b > 127 else b)) & 0xffffffff
+    return (h & _MAX_INT) % reducers
+
+
+def find_routes(reducers):
+    # one route number per reducer, all with the same number of digits
+    digits = 1
+    while True:
+        routes = {}
+        for route in range(10 ** (digits - 1), 10 ** digits):
+            routes.setdefault(key_field_hash(f"[{route}".encode('ascii'), reducers), route)
+            if len(routes) == reducers:
+                return [routes[r] for r in range(reducers)]
+        digits += 1
+
+
+def hash_reducer(unit, reducers):
+    # reducer of a unit missing from the plan
+    return zlib.crc32(str(unit).encode('utf-8')) % reducers
+
+
+def pack(loads, reducers, base=None):
+    # {unit: reducer} placing units largest first on the least loaded reducer,
+    # and the resulting load per reducer
+    totals = list(base or [0] * reducers)
+    assignment = {}
+    for unit, load in sorted(loads.items(), key=lambda item: (-item[1], item[0])):
+        r = min(range(reducers), key=totals.__getitem__)
+        assignment[unit] = r
+        totals[r] += load
+    return assignment, totals
+
+
+def imbalance(totals):
+    mean = sum(totals) / len(totals)
+    return max(totals) / mean if mean else 1.0
+
+
+def sample_lines(path, sample, chunks=64):
+    # about `sample` lines taken from the start of `chunks` ranges spread over the file
+    from review_reader import mapped, iter_lines, split_ranges
+
+    with mapped(path) as buf:
+        for start, end in split_ranges(buf, chunks):
+            for i, line in enumerate(iter_lines(buf, start, end)):
+                if i * chunks >= sample:
+                    break
+                yield line
+
+
+class PartitionPlan(object):
+    """
+    Reducer of every planned term and category, and the route numbers of the reducers.
+    """
+
+    def __init__(self, reducers, routes=None, terms=None, categories=None, stats=None):
+        self.reducers = reducers
+        self.routes = routes or find_routes(reducers)
+        self.units = {'terms': terms or {}, 'categories': categories or {}}
+        self.stats = stats or {}
+        self._reducer_of_route = {route: r for r, route in enumerate(self.routes)}
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['reducers'], data['routes'], data['terms'], data['categories'],
+                   data.get('stats'))
+
+    def dumps(self):
+        return json.dumps({'reducers': self.reducers, 'routes': self.routes,
+                           'stats': self.stats, 'terms': self.units['terms'],
+                           'categories': self.units['categories']})
+
+    def with_ids(self, cat_ids, term_ids):
+        # the same plan for the integer IDs of an ID dictionary
+        return PartitionPlan(
+            self.reducers, self.routes,
+            {term_ids.get(t, t): r for t, r in self.units['terms'].items()},
+            {cat_ids.get(c, c): r for c, r in self.units['categories'].items()}, self.stats)
+
+    def partitioner_options(self):
+        # KeyFieldBasedPartitioner options hashing '[' and the route digits only
+        return f"-k1.1,1.{len(str(self.routes[0])) + 1}"
+
+    def reducer(self, kind, unit):
+        r = self.units[kind].get(unit)
+        return hash_reducer(unit, self.reducers) if r is None else r
+
+    def route(self, kind, unit):
+        return self.routes[self.reducer(kind, unit)]
+
+    def reducer_of_route(self, route):
+        return self._reducer_of_route[route]
+
+
+def build_partition_plan(lines, stopword_filter, reducers=5, max_terms=10000):
+    # plan and load statistics from sampled review lines
+    term_cats = defaultdict(set)
+    cat_terms = defaultdict(set)
+    for line in lines:
+        fields = decode_review(line)
+        if fields is None:
+            continue
+        cat, review_text, summary = fields
+        terms = stopword_filter.unique_terms(tokenize(review_text + ' ' + summary))
+        cat_terms[cat].update(terms)
+        for t in terms:
+            term_cats[t].add(cat)
+
+    # key groups per term: one key per category and the term total
+    term_loads = {t: len(cats) + 1 for t, cats in term_cats.items()}
+    planned = dict(sorted(term_loads.items(), key=lambda item: (-item[1], item[0]))[:max_terms])
+    base = [0] * reducers
+    for t, load in term_loads.items():
+        if t not in planned:
+            base[hash_reducer(t, reducers)] += load
+    terms, term_totals = pack(planned, reducers, base)
+
+    # default partitioning hashes the whole JSON key text of every key
+    term_default = [0] * reducers
+    for t, cats in term_cats.items():
+        for key in [['*', t]] + [[c, t] for c in cats]:
+            term_default[key_field_hash(json.dumps(key).encode('utf-8'), reducers)] += 1
+
+    cat_loads = {c: len(ts) for c, ts in cat_terms.items()}
+    categories, cat_totals = pack(cat_loads, reducers)
+    cat_default = [0] * reducers
+    for c, load in cat_loads.items():
+        cat_default[key_field_hash(json.dumps(c).encode('utf-8'), reducers)] += load
+
+    stats = {}
+    for kind, plan_totals, default_totals in (('terms', term_totals, term_default),
+                                              ('categories', cat_totals, cat_default)):
+        stats[kind] = {
+            'planned load': plan_totals, 'planned imbalance': round(imbalance(plan_totals), 3),
+            'hash load': default_totals, 'hash imbalance': round(imbalance(default_totals), 3),
+        }
+    return PartitionPlan(reducers, terms=terms, categories=categories, stats=stats)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='review JSON-lines file to sample')
+    parser.add_argument('--stopwords', help='stopword file used by the job')
+    parser.add_argument('--reducers', type=int, default=5, help='reducers of the job steps')
+    parser.add_argument('--sample', type=int, default=100000, help='number of reviews to sample')
+    parser.add_argument('--max-terms', type=int, default=10000, help='number of terms placed by the plan')
+    args = parser.parse_args()
+
+    plan = build_partition_plan(sample_lines(args.input, args.sample),
+                                load_stopword_filter(args.stopwords), args.reducers, args.max_terms)
+    for kind, stats in plan.stats.items():
+        sys.stderr.write(f"{kind}: imbalance {stats['hash imbalance']} hashed, "
+                         f"{stats['planned imbalance']} planned, load per reducer "
+                         f"{stats['planned load']}\n")
+    out = open(sys.stdout.fileno(), 'w', encoding='utf-8', closefd=False)
+    out.write(plan.dumps() + '\n')
+    out.flush()
+
+
+if __name__ == '__main__':
+    main()
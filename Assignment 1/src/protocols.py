@@ -0,0 +1,138 @@
+"""
+Compact binary internal protocol for the intermediate records of ChiSquareCalculator.
+
+Keys and values (None, ints, floats, strings and tuples/lists of them) are written as
+binary items behind a single header byte. Small counts, short strings and short
+tuples fit their value or length into that byte; larger ones follow it with a zigzag
+varint. Hadoop streaming is line based and splits key from value at the first tab, so
+backslash, tab, newline and carriage return bytes are backslash-escaped. The encoding is
+deterministic, equal keys always give equal bytes and therefore group together.
+Sequences decode as tuples.
+
+The reserved strings of the job ('!DOC_COUNT', '!DF', never a term since '!' splits
+tokens) get the lowest header byte, 0x00, which is never escaped. Values sorted by
+their bytes (SORT_VALUES) therefore see a ('!DOC_COUNT', ...) record before any
+(term, ...) row of the same length, whatever the term or term ID (see
+tests/test_protocols.py).
+"""
+import re
+import struct
+
+# one header byte: small ints, short strings and short sequences carry their value or
+# length in the header itself, everything else is followed by a zigzag varint
+_RESERVED = 0x00  # reserved '!' string, followed by its length
+_SMALL_INT = 0x01  # + value below 0x3f
+_SHORT_STR, _SHORT_SEQ = 0x40, 0x80  # + length below 0x40
+_NONE, _INT, _STR, _SEQ, _FLOAT = 0xc0, 0xc1, 0xc2, 0xc3, 0xc4
+_DOUBLE = struct.Struct('<d')
+
+_ESCAPES = ((b'\\', b'\\\\'), (b'\t', b'\\t'), (b'\n', b'\\n'), (b'\r', b'\\r'))
+_UNESCAPES = {b'\\': b'\\', b't': b'\t', b'n': b'\n', b'r': b'\r'}
+_ESCAPED = re.compile(rb'\\(.)', re.DOTALL)
+
+
+def _varint(n, out):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _encode(obj, out):
+    if isinstance(obj, str):
+        data = obj.encode('utf-8')
+        if obj.startswith('!'):
+            out.append(_RESERVED)
+            _varint(len(data), out)
+        elif len(data) < 0x40:
+            out.append(_SHORT_STR | len(data))
+        else:
+            out.append(_STR)
+            _varint(len(data), out)
+        out += data
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x3f:
+            out.append(_SMALL_INT + obj)
+        else:
+            out.append(_INT)
+            _varint(obj << 1 if obj >= 0 else (-obj << 1) - 1, out)
+    elif isinstance(obj, (tuple, list)):
+        if len(obj) < 0x40:
+            out.append(_SHORT_SEQ | len(obj))
+        else:
+            out.append(_SEQ)
+            _varint(len(obj), out)
+        for item in obj:
+            _encode(item, out)
+    elif obj is None:
+        out.append(_NONE)
+    elif isinstance(obj, float):
+        out.append(_FLOAT)
+        out += _DOUBLE.pack(obj)
+    else:
+        raise TypeError(f"cannot encode {type(obj).__name__}")
+
+
+def _decode(data, pos):
+    # (object, position after it) of the item starting at pos
+    head = data[pos]
+    pos += 1
+    if _RESERVED < head < 0x40:
+        return head - _SMALL_INT, pos
+    if _SHORT_STR <= head < 0xc0:
+        kind, n = head & 0xc0, head & 0x3f
+    elif head == _NONE:
+        return None, pos
+    elif head == _FLOAT:
+        return _DOUBLE.unpack_from(data, pos)[0], pos + 8
+    else:
+        kind = head
+        n = shift = 0
+        while True:
+            b = data[pos]
+            pos += 1
+            n |= (b & 0x7f) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        if kind == _INT:
+            return (n >> 1) ^ -(n & 1), pos
+
+    if kind == _SHORT_STR or kind == _STR or kind == _RESERVED:
+        return data[pos:pos + n].decode('utf-8'), pos + n
+    if kind == _SHORT_SEQ or kind == _SEQ:
+        items = []
+        for _ in range(n):
+            item, pos = _decode(data, pos)
+            items.append(item)
+        return tuple(items), pos
+    raise ValueError(f"unknown header byte {head}")
+
+
+def encode(obj):
+    out = bytearray()
+    _encode(obj, out)
+    data = bytes(out)
+    for raw, esc in _ESCAPES:
+        if raw in data:
+            data = data.replace(raw, esc)
+    return data
+
+
+def decode(data):
+    if b'\\' in data:
+        data = _ESCAPED.sub(lambda m: _UNESCAPES[m.group(1)], data)
+    return _decode(data, 0)[0]
+
+
+class CompactProtocol(object):
+    """
+    mrjob protocol writing key and value as escaped binary items separated by a tab.
+    """
+
+    def read(self, line):
+        key, _, value = line.partition(b'\t')
+        return decode(key), decode(value)
+
+    def write(self, key, value):
+        return encode(key) + b'\t' + encode(value)
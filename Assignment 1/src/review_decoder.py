@@ -0,0 +1,108 @@
+"""
+Field-selective decoding of review JSON lines.
+
+The mappers only use category, reviewText and summary, so instead of decoding every
+field of a review this module locates those three keys in the raw bytes and decodes
+just their string values. Lines where a field is missing, null, not a string or laid
+out differently fall back to a full parse, which keeps the results of well-formed lines
+identical to json.loads. This is the raw-bytes counterpart of the explicit reviewSchema projection
+used in the Spark notebooks.
+"""
+try:
+    import ujson as json  # faster JSON parser if available
+except ImportError:
+    import json
+from json.decoder import scanstring
+
+FIELDS = ('category', 'reviewText', 'summary')
+_PATTERNS = tuple(b'"' + f.encode() + b'": "' for f in FIELDS)
+_BACKSLASH = 92
+_TIME = b'"unixReviewTime": '
+_DIGITS = frozenset(b'0123456789')
+
+
+def _to_text(line):
+    # same decoding as mrjob's raw protocols: utf-8, falling back to latin-1
+    try:
+        return line.decode('utf-8')
+    except UnicodeDecodeError:
+        return line.decode('latin-1')
+
+
+def _string_at(line, start):
+    # decoded JSON string value starting right after its opening quote, None if unterminated
+    end = line.find(b'"', start)
+    while end != -1:
+        # a quote preceded by an odd number of backslashes is escaped
+        k = end - 1
+        while line[k] == _BACKSLASH:
+            k -= 1
+        if (end - 1 - k) % 2 == 0:
+            break
+        end = line.find(b'"', end + 1)
+    if end == -1:
+        return None
+    raw = line[start:end]
+    if _BACKSLASH in raw:
+        # C string scanner of the json module resolves the escapes
+        return scanstring(raw.decode('utf-8') + '"', 0)[0]
+    return raw.decode('utf-8')
+
+
+def _full_decode(line):
+    try:
+        doc = json.loads(_to_text(line) if isinstance(line, bytes) else line)
+    except Exception:
+        return None
+    if not isinstance(doc, dict):
+        return None
+    return tuple(doc.get(f, '') for f in FIELDS)
+
+
+def decode_review(line):
+    """
+    (category, reviewText, summary) of one review line given as bytes,
+    with '' for missing fields, or None if the line is not a JSON object.
+    """
+    if not isinstance(line, bytes):
+        return _full_decode(line)
+    stripped = line.strip()
+    if not (stripped.startswith(b'{') and stripped.endswith(b'}')):
+        return _full_decode(line)
+
+    values = []
+    try:
+        for pattern in _PATTERNS:
+            # the last occurrence wins, like duplicate keys in json.loads
+            pos = line.rfind(pattern)
+            # a match directly after a backslash would sit inside another string
+            if pos <= 0 or line[pos - 1] == _BACKSLASH:
+                return _full_decode(line)
+            value = _string_at(line, pos + len(pattern))
+            if value is None:
+                return _full_decode(line)
+            values.append(value)
+    except (UnicodeDecodeError, ValueError):
+        return _full_decode(line)
+    return tuple(values)
+
+
+def review_time(line):
+    """
+    unixReviewTime of one review line given as bytes, or None if it has no integer time.
+    """
+    if isinstance(line, bytes):
+        pos = line.rfind(_TIME)
+        if pos > 0 and line[pos - 1] != _BACKSLASH:
+            start = end = pos + len(_TIME)
+            while end < len(line) and line[end] in _DIGITS:
+                end += 1
+            if end > start and line[end:end + 1] in (b',', b'}', b' '):
+                return int(line[start:end])
+        line = _to_text(line)
+    try:
+        doc = json.loads(line)
+    except Exception:
+        return None
+    value = doc.get('unixReviewTime') if isinstance(doc, dict) else None
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
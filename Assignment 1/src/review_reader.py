@@ -0,0 +1,72 @@
+"""
+Memory-mapped reader for review JSON-lines files.
+
+The file is mapped once, cut into newline-aligned byte ranges for N workers, and each
+worker walks its range with mmap.find instead of going through Python's buffered file
+iteration. Every line is copied once, from the shared page cache into the bytes object
+the decoder and mrjob's mapper work on; it is not a zero-copy view. Workers in other
+processes get (path, start, end) descriptors and map the file themselves, since a
+mapping cannot be pickled across process boundaries.
+"""
+import mmap
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def mapped(path):
+    # read-only mapping of the whole file, empty files cannot be mapped
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mm
+        finally:
+            mm.close()
+
+
+def split_ranges(buf, n):
+    # n byte ranges of the buffer, every range starts at the beginning of a line
+    size = len(buf)
+    bounds = [0]
+    for i in range(1, n):
+        pos = max(size * i // n, bounds[-1])
+        if pos >= size:
+            break
+        if pos > 0 and buf[pos - 1:pos] != b'\n':
+            # moving the cut to just after the line it falls into
+            nl = buf.find(b'\n', pos)
+            pos = size if nl < 0 else nl + 1
+        bounds.append(pos)
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def file_ranges(path, n):
+    # (path, start, end) descriptors of n newline-aligned ranges of a file
+    with mapped(path) as buf:
+        return [(path, start, end) for start, end in split_ranges(buf, n)]
+
+
+def iter_lines(buf, start=0, end=None):
+    # non-empty lines of buf[start:end] as bytes, without their line terminators
+    if end is None:
+        end = len(buf)
+    find = buf.find
+    pos = start
+    while pos < end:
+        nl = find(b'\n', pos, end)
+        if nl < 0:
+            nl = end
+        stop = nl - 1 if nl > pos and buf[nl - 1] == 13 else nl  # dropping '\r'
+        if stop > pos:
+            yield buf[pos:stop]
+        pos = nl + 1
+
+
+def read_range(path, start=0, end=None):
+    # lines of one byte range of a file, mapping the file in the calling process
+    with mapped(path) as buf:
+        yield from iter_lines(buf, start, end)
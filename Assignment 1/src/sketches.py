@@ -0,0 +1,178 @@
+"""
+Mergeable sketches for the approximate mode of ChiSquareCalculator.
+
+A Count-Min sketch counts the documents of every term of one category in a fixed
+depth x width table of counters: a term increments one counter per row, picked by a
+hash, and its estimate is the smallest of its counters. Estimates never undercount; with
+total = number of (document, term) updates, an estimate exceeds the true count by more
+than e / width * total with probability at most exp(-depth). Sketches with the same
+shape add up counter by counter, so mapper sketches merge in the reducer, and the sum of
+all category sketches is the sketch of the term totals.
+
+Misra-Gries summaries keep the heavy hitters of a category in `capacity` counters. Every
+term counted in more than total / (capacity + 1) documents is guaranteed to be kept,
+also after merging summaries, so they give the candidate terms for which chi-square is
+computed.
+
+Hashes are derived from blake2b of the term, so they are the same in every process.
+"""
+import base64
+import hashlib
+import struct
+import zlib
+
+import numpy as np
+
+DEFAULT_WIDTH = 1 << 14
+DEFAULT_DEPTH = 4
+DEFAULT_CAPACITY = 2000
+# term hashes remembered per sketch before the memo is cleared
+_MEMO_SIZE = 1 << 20
+# hashed updates buffered before they are added to the table
+_BLOCK_SIZE = 1 << 16
+_HEADER = struct.Struct('<II')
+_LOW = np.uint64(0xffffffff)
+
+
+def term_hash(term):
+    # 64-bit hash of a term, stable across processes unlike hash()
+    digest = hashlib.blake2b(term.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class CountMinSketch(object):
+    """
+    Count-Min sketch of term document counts, depth rows of width int64 counters.
+    """
+
+    def __init__(self, width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self._memo = {}
+        self._pending = []
+
+    def _hashes(self, terms):
+        memo = self._memo
+        if len(memo) > _MEMO_SIZE:
+            memo.clear()
+        hashes = []
+        for term in terms:
+            h = memo.get(term)
+            if h is None:
+                h = memo[term] = term_hash(term)
+            hashes.append(h)
+        return hashes
+
+    def _columns(self, hashes):
+        # (depth, n) counter indices, row i at h1 + i * h2 (Kirsch-Mitzenmacher)
+        h = np.array(hashes, dtype=np.uint64)
+        h1 = h & _LOW
+        h2 = (h >> np.uint64(32)) | np.uint64(1)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        return ((h1 + rows * h2) % np.uint64(self.width)).astype(np.intp)
+
+    def add(self, terms):
+        # counting one document for each of the terms
+        self._pending.extend(self._hashes(terms))
+        if len(self._pending) >= _BLOCK_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        columns = self._columns(self._pending)
+        self._pending = []
+        for row, cols in zip(self.table, columns):
+            row += np.bincount(cols, minlength=self.width)
+
+    def merge(self, other):
+        # adding another sketch of the same shape
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError(f"cannot merge a {other.depth}x{other.width} sketch "
+                             f"into a {self.depth}x{self.width} sketch")
+        self._flush()
+        other._flush()
+        self.table += other.table
+        return self
+
+    def estimate(self, terms):
+        # int64 array of count estimates, never below the true counts
+        self._flush()
+        if not terms:
+            return np.zeros(0, dtype=np.int64)
+        columns = self._columns(self._hashes(terms))
+        return self.table[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+    def total(self):
+        # number of counted updates
+        self._flush()
+        return int(self.table[0].sum())
+
+    def error_bound(self):
+        # overestimate exceeded with probability at most exp(-depth)
+        return np.e / self.width * self.total()
+
+    def dumps(self):
+        # compressed ASCII form for the job's internal protocols
+        self._flush()
+        data = _HEADER.pack(self.width, self.depth) + zlib.compress(self.table.tobytes(), 1)
+        return base64.b85encode(data).decode('ascii')
+
+    @classmethod
+    def loads(cls, text):
+        data = base64.b85decode(text)
+        width, depth = _HEADER.unpack_from(data)
+        sketch = cls(width, depth)
+        table = np.frombuffer(zlib.decompress(data[_HEADER.size:]), dtype=np.int64)
+        sketch.table = table.reshape(depth, width).copy()
+        return sketch
+
+
+class HeavyHitters(object):
+    """
+    Misra-Gries summary keeping the terms of at least total / (capacity + 1) documents.
+    Counts are lower bounds of the true counts.
+
+    New terms always get a counter; once there are twice as many counters as the
+    capacity, the (capacity + 1)-th largest count is taken away from every counter in one
+    batch. That removes at least capacity + 1 times as much as any single term loses, so
+    the guarantee is the same as for decrementing on every new term, at the cost of one
+    sort per capacity new terms.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, counts=None):
+        self.capacity = capacity
+        self.counts = dict(counts or {})
+
+    def add(self, terms):
+        counts = self.counts
+        get = counts.get
+        for term in terms:
+            counts[term] = get(term, 0) + 1
+        if len(counts) > 2 * self.capacity:
+            self._cut()
+
+    def _cut(self):
+        # cutting the summary back to at most capacity counters
+        counts = self.counts
+        if len(counts) > self.capacity:
+            cut = sorted(counts.values(), reverse=True)[self.capacity]
+            self.counts = {t: n - cut for t, n in counts.items() if n > cut}
+
+    def merge(self, other):
+        # summing both summaries and cutting them back to capacity counters
+        counts = self.counts
+        for term, n in other.counts.items():
+            counts[term] = counts.get(term, 0) + n
+        self._cut()
+        return self
+
+    def items(self):
+        # (term, count) pairs sorted by term, at most capacity of them
+        self._cut()
+        return sorted(self.counts.items())
+
+    def terms(self):
+        self._cut()
+        return sorted(self.counts)
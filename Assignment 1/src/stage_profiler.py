@@ -0,0 +1,132 @@
+"""
+Sampled per-phase timing of map and reduce tasks.
+
+Every task keeps one StageProfiler. Only every `sample_every`-th record (or reducer key)
+is timed, phase by phase with perf_counter_ns, and the phase times are scaled up by the
+number of records, so the clock is read a few times per hundred records instead of
+several times per record. Phases that run once per task (the final flush) are timed in
+full. Time the caller spends consuming yielded pairs, i.e. writing the output, is left
+out of every phase.
+
+Record counts are exact. Byte counts are estimated from the serialized size of sampled
+records in the job's internal protocol, except the raw input bytes of the first step.
+"""
+import json
+import os
+import time
+
+clock = time.perf_counter_ns
+
+
+class StageProfiler(object):
+    """
+    Record and byte counts and phase times of one task, e.g. 'step 1 mapper'. The records
+    of a reducer are its keys, their bytes are not measured.
+    """
+
+    def __init__(self, task, sample_every=100, write=None):
+        self.task = task
+        self.sample_every = max(1, sample_every)
+        self.write = write
+        self.records_in = self.records_out = 0
+        self.bytes_in = 0
+        # input records whose phases were timed, output records whose size was measured
+        self.sampled = self.sampled_out = 0
+        self.sampled_in_bytes = self.sampled_out_bytes = 0
+        self.sampled_ns = {}
+        self.exact_ns = {}
+        # the first record is timed, so short tasks still get an estimate
+        self._countdown = 1
+        self._out_countdown = 1
+
+    def record(self, size=None, pair=None):
+        # counting one input record of `size` bytes, or of the serialized (key, value) pair
+        # when it is timed, True if its phases should be timed
+        self.records_in += 1
+        if size is not None:
+            self.bytes_in += size
+        self._countdown -= 1
+        if self._countdown:
+            return False
+        self._countdown = self.sample_every
+        self.sampled += 1
+        if pair is not None and self.write is not None:
+            self.sampled_in_bytes += len(self.write(*pair)) + 1
+        return True
+
+    def add(self, phase, ns, sampled=True):
+        # ns spent in a phase, by a sampled record or (sampled=False) by the whole task
+        times = self.sampled_ns if sampled else self.exact_ns
+        times[phase] = times.get(phase, 0) + ns
+
+    def timed(self, phase, pairs, sampled=True):
+        # yielding the pairs of a generator, adding the time spent producing them to phase
+        it = iter(pairs)
+        ns = 0
+        try:
+            while True:
+                start = clock()
+                try:
+                    pair = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    ns += clock() - start
+                yield pair
+        finally:
+            self.add(phase, ns, sampled)
+
+    def output(self, pairs):
+        # counting the output pairs, measuring every sample_every-th one
+        write = self.write
+        for pair in pairs:
+            self.records_out += 1
+            self._out_countdown -= 1
+            if not self._out_countdown:
+                self._out_countdown = self.sample_every
+                self.sampled_out += 1
+                if write is not None:
+                    self.sampled_out_bytes += len(write(*pair)) + 1
+            yield pair
+
+    def phase_times(self):
+        # estimated ns per phase for all records of the task
+        scale = self.records_in / self.sampled if self.sampled else 0
+        times = {phase: ns * scale for phase, ns in self.sampled_ns.items()}
+        for phase, ns in self.exact_ns.items():
+            times[phase] = times.get(phase, 0) + ns
+        return times
+
+    def counts(self):
+        # record and (estimated) byte counts of the task
+        counts = {'records in': self.records_in}
+        if self.bytes_in:
+            counts['bytes in'] = self.bytes_in
+        elif self.sampled_in_bytes:
+            counts['bytes in'] = int(self.sampled_in_bytes * self.records_in / self.sampled)
+        counts['records out'] = self.records_out
+        if self.sampled_out and self.write is not None:
+            counts['bytes out'] = int(self.sampled_out_bytes * self.records_out / self.sampled_out)
+        counts['records timed'] = self.sampled
+        return counts
+
+    def counters(self):
+        # (name, value) pairs for the counters of the task, times in microseconds
+        for name, value in self.counts().items():
+            yield f"{self.task} {name}", value
+        for phase, ns in sorted(self.phase_times().items()):
+            yield f"{self.task} {phase} us", int(ns / 1000)
+
+    def trace(self):
+        return {
+            'task': self.task,
+            'pid': os.getpid(),
+            'sample_every': self.sample_every,
+            'counts': self.counts(),
+            'phase_us': {phase: round(ns / 1000, 1) for phase, ns in self.phase_times().items()},
+        }
+
+    def append_trace(self, path):
+        # one JSON line per task; short appends from concurrent local tasks do not interleave
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.trace()) + '\n')
@@ -0,0 +1,128 @@
+"""
+Reducer counts and input split size of the ChiSquareCalculator steps, derived from the
+input size and a sample of the reviews instead of fixed values.
+
+The number of distinct terms and (category, term) pairs in n reviews is extrapolated
+with Heaps' law, V(n) = V(sample) * (n / sample) ** beta, where beta comes from the
+growth between every other sampled review and all of them. That gives the shuffle of
+every stage:
+
+- counting: one partial count per distinct key and map task, map tasks from the split size
+- join: one record per distinct key
+- chi-square: one row per (category, term) pair, at most one reducer per category does work
+
+Each stage gets one reducer per REDUCER_BYTES of estimated shuffle, between 1 and the
+maximum, so small inputs do not start idle reducers. The split size spreads the input
+over `slots` map tasks, between MIN_SPLIT and MAX_SPLIT: small inputs are not cut into
+tasks that mostly pay start-up time, large ones still use the cluster. Every choice
+comes with a sentence giving its reason, and any of them can be fixed instead.
+"""
+import json
+import math
+
+from review_decoder import decode_review
+from tokenizer import tokenize
+
+MB = 2 ** 20
+MIN_SPLIT = 16 * MB
+MAX_SPLIT = 256 * MB
+REDUCER_BYTES = 128 * MB
+# the former fixed settings, used with --sizing fixed and when the input cannot be sized
+FIXED = {'split': 128 * MB, 'min split': 1 * MB,
+         'reducers': {'count': 5, 'join': 5, 'score': 5}}
+
+
+def sample_statistics(lines, stopword_filter):
+    # sizes and distinct keys of the sampled reviews, in every other review and in all of them
+    # (every other one rather than the first half, the sample is ordered by file position and
+    # the files by category)
+    docs = size = 0
+    terms, pairs, cats = set(), set(), set()
+    half_terms, half_pairs = set(), set()
+    record_bytes = records = 0
+    for line in lines:
+        fields = decode_review(line)
+        if fields is None:
+            continue
+        docs += 1
+        size += len(line) + 1
+        cat, review_text, summary = fields
+        cats.add(cat)
+        unique = stopword_filter.unique_terms(tokenize(review_text + ' ' + summary))
+        if docs % 2:
+            half_terms.update(unique)
+            half_pairs.update((cat, t) for t in unique)
+        for t in unique:
+            terms.add(t)
+            if (cat, t) not in pairs:
+                pairs.add((cat, t))
+                # JSON size of the (category, term) count record
+                record_bytes += len(json.dumps([cat, t])) + 4
+                records += 1
+    return {
+        'docs': docs, 'bytes': size, 'categories': len(cats),
+        'terms': (len(half_terms), len(terms)),
+        'pairs': (len(half_pairs), len(pairs)),
+        'record bytes': record_bytes / records if records else 0,
+    }
+
+
+def extrapolate(counts, sample_docs, docs):
+    # distinct keys in `docs` reviews from their (every other review, whole sample) counts
+    half, full = counts
+    if not full or not sample_docs:
+        return 0
+    beta = math.log(full / half, 2) if half else 1.0
+    beta = min(max(beta, 0.0), 1.0)
+    return full * (docs / sample_docs) ** beta
+
+
+def reducers_for(shuffle_bytes, max_reducers):
+    return min(max(math.ceil(shuffle_bytes / REDUCER_BYTES), 1), max_reducers)
+
+
+def size_steps(input_bytes, stats, slots=40, max_reducers=32, split=None, reducers=None):
+    """
+    {'split', 'min split', 'reducers': {stage: count}} for an input of input_bytes with the
+    sample_statistics stats, and the reasons of the choices. split (bytes) and reducers
+    replace the derived values.
+    """
+    reasons = []
+    mb = input_bytes / MB
+    if split:
+        reasons.append(f"split {split / MB:.0f} MB: given")
+    else:
+        split = min(max(math.ceil(input_bytes / slots / MB) * MB, MIN_SPLIT), MAX_SPLIT)
+        reasons.append(f"split {split / MB:.0f} MB: {mb:,.0f} MB of input over {slots} task slots, "
+                       f"within {MIN_SPLIT // MB}-{MAX_SPLIT // MB} MB")
+    maps = max(math.ceil(input_bytes / split), 1)
+
+    sample_docs = stats['docs']
+    docs = input_bytes / stats['bytes'] * sample_docs if stats['bytes'] else 0
+    per_map = docs / maps
+
+    def keys(n):
+        # distinct counting keys in n reviews: pairs, term totals and doc counts
+        return (extrapolate(stats['pairs'], sample_docs, n)
+                + extrapolate(stats['terms'], sample_docs, n) + stats['categories'])
+
+    record = stats['record bytes']
+    shuffle = {
+        'count': maps * keys(per_map) * record,
+        'join': keys(docs) * record,
+        'score': extrapolate(stats['pairs'], sample_docs, docs) * record,
+    }
+    limits = {'count': max_reducers, 'join': max_reducers,
+              'score': max(min(max_reducers, stats['categories']), 1)}
+    counts = {}
+    for stage, size in shuffle.items():
+        if reducers:
+            counts[stage] = reducers
+            reasons.append(f"{stage} reducers {reducers}: given")
+            continue
+        counts[stage] = reducers_for(size, limits[stage])
+        reasons.append(f"{stage} reducers {counts[stage]}: ~{size / MB:,.1f} MB shuffle "
+                       f"at {REDUCER_BYTES // MB} MB per reducer, at most {limits[stage]}")
+    reasons.insert(0, f"input {mb:,.1f} MB, ~{docs:,.0f} reviews, {maps} map tasks, "
+                      f"~{keys(docs):,.0f} distinct keys (sample of {sample_docs:,} reviews)")
+    return {'split': split, 'min split': min(split, FIXED['min split']), 'reducers': counts}, reasons
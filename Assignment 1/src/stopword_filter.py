@@ -0,0 +1,54 @@
+"""
+Precompiled stopword filter for the mapper hot loop.
+
+Instead of a length check, a stopword lookup and a seen-set insertion per token in
+Python, the unique terms of a document are found with set operations in C: the tokens
+are deduplicated by set(), the stopwords and all single ASCII characters are removed
+with one difference against an interned frozenset, and only the surviving unique tokens
+still pay the length check for non-ASCII single characters.
+
+Filters are cached per process by stopword file, path, size and modification time, so
+every task a process runs after the first reuses the filter: the workers of the
+multiprocess engine, the inline runner, and Hadoop streaming tasks whose interpreter
+outlives a task.
+"""
+import os
+import sys
+
+_FILTERS = {}
+
+
+class StopwordFilter(object):
+    """
+    Unique terms of a document: tokens longer than one character that are not stopwords.
+    """
+
+    def __init__(self, stopwords=()):
+        self.stopwords = frozenset(sys.intern(w) for w in stopwords)
+        # single ASCII characters go out with the stopwords, in the same set operation
+        self.dropped = self.stopwords | frozenset(map(chr, range(0x80)))
+
+    def __contains__(self, token):
+        return token in self.stopwords
+
+    def unique_terms(self, tokens):
+        # unique kept tokens of one document, in no particular order
+        return [t for t in set(tokens).difference(self.dropped) if len(t) > 1]
+
+
+def read_stopwords(path):
+    with open(path) as f:
+        return [line.strip() for line in f]
+
+
+def load_stopword_filter(path):
+    # filter of a stopword file (None for no stopwords), built once per process and file version
+    if not path:
+        key = None
+    else:
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    flt = _FILTERS.get(key)
+    if flt is None:
+        flt = _FILTERS[key] = StopwordFilter(read_stopwords(path) if path else ())
+    return flt
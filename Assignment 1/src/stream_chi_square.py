@@ -0,0 +1,244 @@
+"""
+Streaming chi-square over a sliding window of unixReviewTime.
+
+Reviews are read continuously (a followed file or an in-process queue) and counted with
+the same model as ChiSquareCalculator: documents per category, documents per
+(category, term) and documents per term, every term once per review. The counts are
+kept per time bucket of `slide` seconds and summed over the window of the newest
+`window // slide` buckets. When event time moves past a bucket, its counts are
+subtracted from the window and dropped, so memory follows the window and not the
+stream. Reviews older than the window arrive too late and are only counted as late.
+
+Top-K queries score the window counts with the job's TopK kernel and are cached until
+the counts change, so repeated queries are answered without rescoring. A window that
+covers the whole input gives exactly the output of ChiSquareCalculator.
+
+Print the top 75 terms per category of a 7-day window sliding by one day, every time
+the window moves, while following a growing file:
+
+    python stream_chi_square.py --stopwords ../Assignment_1_Assets/stopwords.txt --window 604800 --slide 86400 --follow reviews.json
+"""
+import argparse
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from chi_kernel import TopK
+from review_decoder import decode_review, review_time
+from review_reader import read_range
+from stopword_filter import load_stopword_filter
+from tokenizer import tokenize
+
+
+class SlidingWindowCounts(object):
+    """
+    Document frequencies of the reviews in the newest `window // slide` buckets of `slide` seconds.
+    """
+
+    def __init__(self, window, slide):
+        self.slide = slide
+        self.span = max(1, window // slide)
+        self.buckets = {}  # bucket -> (docs per category, docs per (category, term))
+        self.doc_counts = Counter()
+        self.pair_counts = defaultdict(Counter)  # category -> term -> docs
+        self.term_totals = Counter()
+        self.newest = None
+        self.late = 0
+
+    def bucket(self, t):
+        return t // self.slide
+
+    def bounds(self):
+        # [start, end) event time covered by the window
+        if self.newest is None:
+            return None
+        return (self.newest - self.span + 1) * self.slide, (self.newest + 1) * self.slide
+
+    def add(self, t, cat, terms):
+        # counting one review, False if it is older than the window
+        b = t // self.slide
+        if self.newest is None or b > self.newest:
+            self.advance(b)
+        elif b <= self.newest - self.span:
+            self.late += 1
+            return False
+        docs, pairs = self.buckets.setdefault(b, (Counter(), Counter()))
+        docs[cat] += 1
+        self.doc_counts[cat] += 1
+        cat_counts = self.pair_counts[cat]
+        for term in terms:
+            pairs[(cat, term)] += 1
+            cat_counts[term] += 1
+            self.term_totals[term] += 1
+        return True
+
+    def advance(self, b):
+        # moving the window end to bucket b, expiring the buckets that fall out of it
+        self.newest = b
+        for old in [x for x in self.buckets if x <= b - self.span]:
+            self._expire(old)
+
+    def _expire(self, bucket):
+        docs, pairs = self.buckets.pop(bucket)
+        for cat, n in docs.items():
+            _subtract(self.doc_counts, cat, n)
+        for (cat, term), n in pairs.items():
+            cat_counts = self.pair_counts[cat]
+            _subtract(cat_counts, term, n)
+            if not cat_counts:
+                del self.pair_counts[cat]
+            _subtract(self.term_totals, term, n)
+
+
+def _subtract(counter, key, n):
+    # decrementing a count and dropping it at zero, so expired keys free their memory
+    left = counter[key] - n
+    if left:
+        counter[key] = left
+    else:
+        del counter[key]
+
+
+class StreamingChiSquare(object):
+    """
+    Sliding-window chi-square ranking of a review stream, safe to query from other threads.
+    """
+
+    def __init__(self, window, slide, k=75, stopword_filter=None):
+        self.counts = SlidingWindowCounts(window, slide)
+        self.k = k
+        self.stopword_filter = stopword_filter or load_stopword_filter(None)
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._ranking = None
+
+    def parse(self, line):
+        # (time, category, unique terms) of one review line, None if it cannot be used
+        fields = decode_review(line)
+        t = review_time(line) if fields is not None else None
+        if t is None:
+            self.skipped += 1
+            return None
+        cat, review_text, summary = fields
+        return t, cat, self.stopword_filter.unique_terms(tokenize(review_text + ' ' + summary))
+
+    def add(self, t, cat, terms):
+        with self._lock:
+            if self.counts.add(t, cat, terms):
+                self._ranking = None
+
+    def advance(self, t):
+        # moving event time forward without a review, e.g. on a clock tick
+        with self._lock:
+            b = self.counts.bucket(t)
+            if self.counts.newest is None or b > self.counts.newest:
+                self.counts.advance(b)
+                self._ranking = None
+
+    def consume(self, lines, on_slide=None):
+        # counting a stream of review lines, calling on_slide(self) before the window moves
+        for line in lines:
+            parsed = self.parse(line)
+            if parsed is None:
+                continue
+            newest = self.counts.newest
+            if on_slide is not None and newest is not None and self.counts.bucket(parsed[0]) > newest:
+                on_slide(self)
+            self.add(*parsed)
+
+    def top_k(self):
+        # {category: [(term, chi-square), ...]} of the current window, best first
+        with self._lock:
+            if self._ranking is None:
+                counts = self.counts
+                N = sum(counts.doc_counts.values())
+                totals = counts.term_totals
+                ranking = {}
+                for cat, cat_counts in counts.pair_counts.items():
+                    top = TopK(self.k, N, counts.doc_counts.get(cat, 0))
+                    for term, A in cat_counts.items():
+                        top.add(term, A, totals[term])
+                    best = top.result()
+                    if best:
+                        ranking[cat] = best
+                self._ranking = ranking
+            return self._ranking
+
+    def lines(self):
+        # the window's ranking in the output format of ChiSquareCalculator
+        ranking = self.top_k()
+        out = [cat + ' ' + ' '.join(f"{t}:{v:.3f}" for t, v in ranking[cat])
+               for cat in sorted(ranking)]
+        out.append(' '.join(sorted({t for best in ranking.values() for t, _ in best})))
+        return out
+
+
+def follow(path, poll=1.0):
+    # lines of a growing file like tail -f, a partial last line waits for its newline
+    with open(path, 'rb') as f:
+        pending = b''
+        while True:
+            chunk = f.readline()
+            if not chunk:
+                time.sleep(poll)
+                continue
+            pending += chunk
+            if pending.endswith(b'\n'):
+                line = pending.rstrip(b'\r\n')
+                pending = b''
+                if line:
+                    yield line
+
+
+def iter_queue(q, stop=None):
+    # lines put into an in-process queue until the stop sentinel arrives
+    while True:
+        line = q.get()
+        if line is stop:
+            return
+        yield line
+
+
+def start_queue_consumer(service, q, on_slide=None):
+    # consuming a queue.Queue of review lines in a daemon thread; put None to stop it
+    thread = threading.Thread(target=service.consume, args=(iter_queue(q), on_slide), daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='review JSON-lines file')
+    parser.add_argument('--stopwords', help='stopword file')
+    parser.add_argument('--window', type=int, default=7 * 86400, help='window length in seconds')
+    parser.add_argument('--slide', type=int, default=86400, help='window step in seconds')
+    parser.add_argument('--top-k', type=int, default=75, help='number of terms kept per category')
+    parser.add_argument('--follow', action='store_true', help='keep reading as the file grows')
+    parser.add_argument('--poll', type=float, default=1.0, help='seconds between reads at end of file')
+    args = parser.parse_args()
+
+    service = StreamingChiSquare(args.window, args.slide, args.top_k,
+                                 load_stopword_filter(args.stopwords))
+    out = open(sys.stdout.fileno(), 'w', encoding='utf-8', closefd=False)
+
+    def report(service):
+        start, end = service.counts.bounds()
+        out.write(f"# window {start} {end}\n")
+        out.write('\n'.join(service.lines()) + '\n')
+        out.flush()
+
+    lines = follow(args.input, args.poll) if args.follow else read_range(args.input)
+    try:
+        service.consume(lines, report)
+    except KeyboardInterrupt:
+        pass
+    if service.counts.newest is not None:
+        report(service)
+    if service.skipped or service.counts.late:
+        sys.stderr.write(f"skipped {service.skipped} reviews without category or time, "
+                         f"{service.counts.late} late reviews\n")
+
+
+if __name__ == '__main__':
+    main()
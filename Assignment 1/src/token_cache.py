@@ -0,0 +1,163 @@
+"""
+Columnar cache of the tokenized corpus, replacing chi_input.csv.
+
+preprocessing.py writes one row per review to a Parquet file: the category as a
+dictionary-encoded string column and the review tokens as a list<int32> column of
+token IDs, zstd-compressed and chunked into row groups of ROW_GROUP_SIZE reviews. The
+IDs index the vocabulary written next to it (chi_input.vocab.parquet for
+chi_input.parquet), in order of first appearance. Readers stream one row group at a
+time and get the IDs as flat numpy arrays, so nothing is parsed with csv or
+ast.literal_eval.
+
+Tokens are cached before stopword filtering (single characters are dropped already),
+so re-running the statistics with another stopword list or another K only reads the
+cache; the stopwords are removed by ID while counting.
+
+pyarrow is only needed for the cache:
+
+    pip install pyarrow
+"""
+import json
+import os
+from collections import Counter
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = pq = None
+
+# reviews per row group, the unit readers stream
+ROW_GROUP_SIZE = 100000
+# schema metadata entry describing what the cache was built from
+_METADATA_KEY = b'token_cache'
+
+
+def _require_pyarrow():
+    if pq is None:
+        raise ImportError('the token cache needs pyarrow (pip install pyarrow)')
+
+
+def vocabulary_path(path):
+    # vocabulary file belonging to a token cache
+    root, ext = os.path.splitext(path)
+    return root + '.vocab' + (ext or '.parquet')
+
+
+class TokenCacheWriter(object):
+    """
+    Writes (category, tokens) rows to a token cache and its vocabulary on close,
+    with an optional JSON-serializable description of its source (see read_metadata).
+    """
+
+    def __init__(self, path, row_group_size=ROW_GROUP_SIZE, compression='zstd', metadata=None):
+        _require_pyarrow()
+        self.path = path
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.term_ids = {}
+        self.categories, self.token_ids = [], []
+        schema = pa.schema([('category', pa.dictionary(pa.int32(), pa.string())),
+                            ('tokens', pa.list_(pa.int32()))])
+        if metadata is not None:
+            schema = schema.with_metadata({_METADATA_KEY: json.dumps(metadata).encode('utf-8')})
+        self.writer = pq.ParquetWriter(path, schema, compression=compression)
+
+    def write(self, category, tokens):
+        ids = self.term_ids
+        self.categories.append(category)
+        self.token_ids.append([ids.setdefault(t, len(ids)) for t in tokens])
+        if len(self.categories) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self.categories:
+            return
+        table = pa.table({
+            'category': pa.array(self.categories, pa.string()).dictionary_encode(),
+            'tokens': pa.array(self.token_ids, pa.list_(pa.int32())),
+        })
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+        self.categories, self.token_ids = [], []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+        vocabulary = pa.table({'term': pa.array(list(self.term_ids), pa.string())})
+        pq.write_table(vocabulary, vocabulary_path(self.path), compression=self.compression)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_metadata(path):
+    # source description stored by the writer, None if the cache or its vocabulary is missing
+    _require_pyarrow()
+    if not (os.path.isfile(path) and os.path.isfile(vocabulary_path(path))):
+        return None
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    if _METADATA_KEY not in metadata:
+        return None
+    return json.loads(metadata[_METADATA_KEY])
+
+
+def read_vocabulary(path):
+    # terms of a vocabulary file, indexed by token ID
+    _require_pyarrow()
+    return pq.read_table(path, columns=['term']).column('term').to_pylist()
+
+
+def iter_row_groups(path):
+    # (categories, token counts per row, flat token IDs) of every row group in turn
+    _require_pyarrow()
+    cache = pq.ParquetFile(path)
+    for i in range(cache.num_row_groups):
+        group = cache.read_row_group(i, columns=['category', 'tokens'])
+        tokens = group.column('tokens').combine_chunks()
+        lengths = pc.list_value_length(tokens).fill_null(0).to_numpy(zero_copy_only=False)
+        ids = pc.list_flatten(tokens).to_numpy(zero_copy_only=False)
+        categories = ['' if c is None else c for c in group.column('category').to_pylist()]
+        yield categories, lengths, ids
+
+
+def document_frequencies(path, vocabulary, stopwords=()):
+    """
+    (docs per category, docs per (category, term), docs per term) of a token cache,
+    counting every term once per document and skipping stopwords.
+    """
+    size = max(len(vocabulary), 1)
+    stop_ids = np.array([i for i, t in enumerate(vocabulary) if t in stopwords], dtype=np.int64)
+    cat_codes = {}
+    doc_counts = Counter()
+    pair_counts = Counter()
+    term_totals = np.zeros(size, dtype=np.int64)
+
+    for categories, lengths, ids in iter_row_groups(path):
+        doc_counts.update(categories)
+        codes = np.array([cat_codes.setdefault(c, len(cat_codes)) for c in categories],
+                         dtype=np.int64)
+        docs = np.repeat(np.arange(len(categories), dtype=np.int64), lengths)
+        ids = ids.astype(np.int64)
+        if stop_ids.size:
+            keep = ~np.isin(ids, stop_ids)
+            docs, ids = docs[keep], ids[keep]
+        # unique (document, term) pairs, then documents per (category, term)
+        doc_terms = np.unique(docs * size + ids)
+        docs, ids = np.divmod(doc_terms, size)
+        term_totals += np.bincount(ids, minlength=size)
+        keys, counts = np.unique(codes[docs] * size + ids, return_counts=True)
+        pair_counts.update(dict(zip(keys.tolist(), counts.tolist())))
+
+    categories = list(cat_codes)
+    pairs = {(categories[k // size], vocabulary[k % size]): n for k, n in pair_counts.items()}
+    totals = {vocabulary[i]: int(term_totals[i]) for i in np.flatnonzero(term_totals)}
+    return doc_counts, pairs, totals
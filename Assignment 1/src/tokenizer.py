@@ -0,0 +1,81 @@
+"""
+Shared tokenizer for the review text of all Python entry points.
+
+Text is lower-cased, every delimiter is mapped to a space by a translation table built
+once per process, and the result is split at whitespace, all of it in C. The mapping
+runs on the UTF-8 bytes with a 256-entry table, which is much cheaper than the
+per-character dict lookups of str.translate on non-ASCII text; the few non-ASCII
+delimiters are replaced beforehand. UTF-8 continuation bytes are never below 0x80, so
+only whole ASCII characters are touched. Decoding before the split keeps the split at
+Unicode whitespace.
+
+The archived scripts split with the regular expression [\\s\\d<delimiters>]+, which also
+treats '$' and non-ASCII decimal digits as delimiters. REGEX_TOKENIZER, built once per
+process like TOKENIZER, gives exactly their tokens, so their output does not change.
+
+    >>> tokenize('Great value!! 5 stars, would buy again')
+    ['great', 'value', 'stars', 'would', 'buy', 'again']
+"""
+import sys
+
+# assignment provided delimiters, digits included
+DELIMITERS = r'''()[]{}.!?,;:+=-_"'`~#@&*%€§\/0123456789'''
+# delimiter class of the archived scripts' regular expression
+REGEX_DELIMITERS = DELIMITERS + '$'
+# non-ASCII delimiters replaced one by one before the byte-level translation, more than
+# this many (all Unicode digits) use str.translate instead
+_MAX_REPLACED = 8
+
+
+def translation_table(delimiters, unicode_digits=False):
+    # str.translate table mapping every delimiter (and optionally every decimal digit) to a space
+    chars = set(delimiters)
+    if unicode_digits:
+        chars.update(c for c in map(chr, range(sys.maxunicode + 1)) if c.isdecimal())
+    return str.maketrans(dict.fromkeys(chars, ' '))
+
+
+def byte_table(table):
+    # bytes.translate table for the ASCII delimiters; str.split also splits at \x1c-\x1f
+    return bytes(0x20 if b < 0x80 and (chr(b).isspace() or b in table) else b
+                 for b in range(256))
+
+
+class Tokenizer(object):
+    """
+    Splits text into lower-cased tokens at whitespace and delimiter characters.
+    """
+
+    def __init__(self, delimiters=DELIMITERS, unicode_digits=False):
+        self.delimiters = delimiters
+        self.unicode_digits = unicode_digits
+        self.table = translation_table(delimiters, unicode_digits)
+        self.byte_table = byte_table(self.table)
+        replaced = [chr(c) for c in self.table if c >= 0x80]
+        self.replaced = replaced if len(replaced) <= _MAX_REPLACED else None
+
+    def config(self):
+        # settings that determine the tokens, e.g. for cache keys
+        return {'delimiters': self.delimiters, 'unicode_digits': self.unicode_digits}
+
+    def tokenize(self, text):
+        text = text.lower()
+        if not text.isascii():
+            if self.replaced is None:
+                return text.translate(self.table).split()
+            for c in self.replaced:
+                if c in text:
+                    text = text.replace(c, ' ')
+        # surrogatepass round-trips lone surrogates from JSON escapes
+        data = text.encode('utf-8', 'surrogatepass').translate(self.byte_table)
+        return data.decode('utf-8', 'surrogatepass').split()
+
+    def tokenize_batch(self, texts):
+        # token lists of many texts
+        return list(map(self.tokenize, texts))
+
+
+TOKENIZER = Tokenizer()
+REGEX_TOKENIZER = Tokenizer(REGEX_DELIMITERS, unicode_digits=True)
+tokenize = TOKENIZER.tokenize
+tokenize_batch = TOKENIZER.tokenize_batch
@@ -0,0 +1,106 @@
+import json
+import math
+import random
+
+import numpy as np
+import pytest
+
+from chi_kernel import STATISTICS, TopK, chi_square_columns, top_k
+
+
+def baseline_chi2(A, T, C, N):
+    # the formula of the baseline reducer_final, None where it skipped the term
+    B = T - A
+    D = N - C - B - A
+    denom = (A+B)*(C+D)*(A+C)*(B+D)
+    if denom == 0:
+        return None
+    return N * (A*D - B*C)**2 / denom
+
+
+def baseline_top(rows, C, N, k):
+    # baseline selection: terms in shuffle-key order, stable sort by descending chi-square
+    scored = []
+    for term, A, T in sorted(rows, key=lambda row: json.dumps(row[0])):
+        chi2 = baseline_chi2(A, T, C, N)
+        if chi2 is not None:
+            scored.append((term, chi2))
+    return sorted(scored, key=lambda x: -x[1])[:k]
+
+
+def random_tables(trials=2000, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(trials):
+        N = rng.choice([1, 2, 10, 1000, 10**6, 8 * 10**7])
+        C = rng.randint(0, N)
+        T = rng.randint(0, N)
+        A = rng.randint(max(0, T + C - N), min(T, C))
+        rows.append((A, T, C, N))
+    return rows
+
+
+# term in every document, category holding every document, empty corpus and other
+# tables with denom == 0
+DEGENERATE = [(5, 10, 5, 10), (10, 10, 10, 10), (0, 0, 0, 0), (3, 3, 10, 10), (0, 7, 0, 7),
+              (4, 4, 4, 8), (0, 0, 5, 5)]
+
+
+@pytest.mark.parametrize('table', random_tables() + DEGENERATE)
+def test_chi_square_matches_baseline_formula(table):
+    A, T, C, N = table
+    expected = baseline_chi2(A, T, C, N)
+    got = chi_square_columns([A], [T], C, N)[0]
+    if expected is None:
+        assert np.isnan(got)
+    else:
+        assert got == pytest.approx(expected, rel=1e-9, abs=1e-9)
+        assert f"{got:.3f}" == f"{expected:.3f}"
+
+
+def test_degenerate_tables_have_zero_denominators():
+    assert all(baseline_chi2(*table) is None for table in DEGENERATE[:3])
+
+
+@pytest.mark.parametrize('name', sorted(STATISTICS))
+def test_statistics_match_scalar_formulas(name):
+    columns, scalar, _ = STATISTICS[name]
+    for A, T, C, N in random_tables(500, seed=1) + DEGENERATE:
+        expected = scalar(A, T, C, N)
+        got = columns([A], [T], C, N)[0]
+        if expected is None:
+            assert np.isnan(got)
+        else:
+            assert got == pytest.approx(expected, rel=1e-9, abs=1e-9)
+
+
+def test_top_k_matches_baseline_selection():
+    rng = random.Random(2)
+    N, C = 5000, 700
+    terms = ['café', 'cafa', 'cafz', 'zzq', 'naïve', 'über', 'price'] + [f"t{i}" for i in range(3000)]
+    rows = []
+    for term in terms:
+        T = rng.randint(1, 60)
+        # few distinct counts, so many scores tie across the k-th place
+        rows.append((term, rng.randint(max(0, T + C - N), min(T, C, 3)), T))
+    rows += [('always', C, N), ('never', 0, 0)]
+    for k in (1, 5, 75, 10000):
+        top = TopK(k, N, C, block_size=512)
+        for row in rows:
+            top.add(*row)
+        got = top.result()
+        expected = baseline_top(rows, C, N, k)
+        assert [t for t, _ in got] == [t for t, _ in expected]
+        assert [f"{v:.3f}" for _, v in got] == [f"{v:.3f}" for _, v in expected]
+
+
+def test_top_k_breaks_ties_by_json_text():
+    terms = ['zzq', 'cafz', 'café', 'cafa']
+    chi2 = np.array([1.5, 1.5, 1.5, 1.5])
+    assert [terms[i] for i in top_k(chi2, terms, 4)] == ['café', 'cafa', 'cafz', 'zzq']
+
+
+def test_top_k_skips_nan_and_empty_k():
+    chi2 = np.array([math.nan, 2.0, 1.0])
+    assert list(top_k(chi2, ['a', 'b', 'c'], 3)) == [1, 2]
+    assert len(top_k(chi2, ['a', 'b', 'c'], 0)) == 0
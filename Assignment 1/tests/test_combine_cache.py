@@ -0,0 +1,51 @@
+import random
+from collections import Counter
+
+import pytest
+
+from combine_cache import AggregationCache
+
+
+def reviews(n=3000, seed=0):
+    rng = random.Random(seed)
+    vocabulary = [f"t{i}" for i in range(2000)]
+    for _ in range(n):
+        # Zipf-like terms, so some keys stay hot while the tail is spilled
+        terms = {vocabulary[min(int(rng.paretovariate(1.0)) - 1, 1999)] for _ in range(20)}
+        yield rng.choice(['Books', 'Music', 'Toys']), sorted(terms)
+
+
+def exact_counts():
+    counts = Counter()
+    for cat, terms in reviews():
+        counts[('!DOC_COUNT', cat)] += 1
+        for t in terms:
+            counts[(cat, t)] += 1
+            counts[('*', t)] += 1
+    return counts
+
+
+@pytest.mark.parametrize('limits', [(None, None), (200, None), (1, None), (None, 20000)])
+def test_spilled_and_flushed_pairs_sum_to_exact_counts(limits):
+    cache = AggregationCache(*limits)
+    summed = Counter()
+    for cat, terms in reviews():
+        cache.add_review(cat, terms)
+        if limits[0]:
+            assert len(cache.counts) <= limits[0]
+        for key, count in cache.drain():
+            summed[key] += count
+    for key, count in cache.flush():
+        summed[key] += count
+    assert summed == exact_counts()
+    stats = cache.stats()
+    assert stats['hits'] + stats['misses'] == sum(1 + 2 * len(terms) for _, terms in reviews())
+
+
+def test_hot_keys_survive_a_spill():
+    cache = AggregationCache(max_entries=10)
+    for _ in range(5):
+        cache.add_review('Books', ['hot'])
+    cache.add_review('Books', [f"cold{i}" for i in range(5)])
+    assert ('Books', 'hot') in cache.counts and cache.counts[('Books', 'hot')] == 5
+    assert cache.evictions == len(cache.drain())
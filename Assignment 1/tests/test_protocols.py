@@ -0,0 +1,28 @@
+import pytest
+
+from protocols import CompactProtocol, decode, encode
+
+BROADCAST = ('!DOC_COUNT', [(0, 5), ('Books', 10 ** 6)], 0)
+
+# string terms (short, empty, long) and integer term IDs (small, escaped, large, negative)
+ROWS = [('', 0, 0), ('a', 1, 1), ('zzzz', 2, 3), ('é' * 40, 7, 9), (0, 1, 1), (1, 9, 9),
+        (8, 1, 2), (9, 1, 2), (12, 1, 2), (62, 3, 3), (63, 3, 3), (91, 1, 1), (5000, 1, 1),
+        (10 ** 9, 2, 2), (-1, 1, 1)]
+
+
+@pytest.mark.parametrize('row', ROWS)
+def test_doc_counts_sort_before_term_rows(row):
+    assert encode(BROADCAST) < encode(row)
+
+
+@pytest.mark.parametrize('value', ROWS + [BROADCAST, None, 1.5, ('!DF', 3, 4), 'a\tb\nc\\d\r'])
+def test_round_trip(value):
+    expected = tuple(tuple(v) if isinstance(v, list) else v for v in value) \
+        if isinstance(value, tuple) else value
+    assert decode(encode(value)) == expected
+
+
+def test_lines_have_no_raw_separators():
+    line = CompactProtocol().write(('a\tb', 9), ('\n', 10, 13, '\\'))
+    assert b'\n' not in line and line.count(b'\t') == 1
+    assert CompactProtocol().read(line) == (('a\tb', 9), ('\n', 10, 13, '\\'))